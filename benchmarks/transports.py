@@ -0,0 +1,122 @@
+"""Sessions per second and memory per session of each scrapli transport, against a real device.
+
+Opens --sessions sessions to the device the same way the API does (asyncssh natively, the blocking
+transports through ThreadedDriver, platform and credentials from the inventory), runs a command on
+each while they are all open, then closes them.
+Memory is the resident size of this process and its children (the ssh processes of the system
+transport) while every session is open, less what it was before. Each transport is measured in a
+fresh interpreter, as memory freed by one run stays with the process and would hide the cost of the
+next. Linux only.
+
+    USERNAME=admin PASSWORD=secret python benchmarks/transports.py 10.0.0.1 --sessions 50
+"""
+from pathlib import Path
+import argparse, asyncio, json, os, subprocess, sys, time
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from network_device_api.connect_device import _device_settings
+from network_device_api.inventory import inventory
+from network_device_api.transports import ASYNC_TRANSPORTS, SYNC_TRANSPORTS, threaded
+from network_device_api import transports
+
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+
+
+def rss(pid):
+    """Resident bytes of a process, 0 if it has already gone."""
+    try:
+        return int(Path(f"/proc/{pid}/statm").read_text().split()[1]) * PAGE_SIZE
+    except (FileNotFoundError, ProcessLookupError):
+        return 0
+
+
+def children(pid):
+    found = []
+    for stat in Path("/proc").glob("[0-9]*/stat"):
+        try:
+            fields = stat.read_text().rsplit(")", 1)[1].split()
+        except (FileNotFoundError, ProcessLookupError):
+            continue
+        if int(fields[1]) == pid:
+            child = int(stat.parent.name)
+            found += [child] + children(child)
+    return found
+
+
+def memory():
+    pid = os.getpid()
+    return rss(pid) + sum(rss(child) for child in children(pid))
+
+
+async def benchmark(transport, host, username, password, sessions, concurrency, command):
+    device = inventory.get(host)
+    driver = device.async_driver if transport in ASYNC_TRANSPORTS else threaded(device.driver)
+    settings = _device_settings(host, username, password, transport=transport)
+    limit = asyncio.Semaphore(concurrency)
+    baseline = memory()
+
+    async def open_session():
+        async with limit:
+            conn = driver(**settings)
+            await conn.open()
+            return conn
+
+    started = time.perf_counter()
+    conns = await asyncio.gather(*[open_session() for _ in range(sessions)])
+    opened = time.perf_counter() - started
+
+    await asyncio.gather(*[conn.send_command(command) for conn in conns])
+    used = memory() - baseline
+    await asyncio.gather(*[conn.close() for conn in conns])
+
+    return {
+        "transport": transport,
+        "sessions_per_second": sessions / opened,
+        "memory_per_session_kb": used / sessions / 1024,
+    }
+
+
+def run_alone(args, transport):
+    """Benchmark one transport in a child interpreter, returning its result."""
+    command = [sys.executable, __file__, args.host, "--transports", transport, "--sessions", str(args.sessions),
+               "--concurrency", str(args.concurrency), "--command", args.command, "--json"]
+    child = subprocess.run(command, capture_output=True, text=True)
+    if child.returncode != 0:
+        raise RuntimeError((child.stderr.strip().splitlines() or [f"exited with {child.returncode}"])[-1])
+    return json.loads(child.stdout)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("host")
+    parser.add_argument("--sessions", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=20, help="sessions opened at once")
+    parser.add_argument("--command", default="show clock")
+    parser.add_argument("--transports", default=",".join(ASYNC_TRANSPORTS + SYNC_TRANSPORTS))
+    parser.add_argument("--json", action="store_true", help="measure one transport in this process and print its result as JSON")
+    args = parser.parse_args(argv)
+
+    if args.json:
+        transports.check_transport(args.transports)
+        transports.TRANSPORT_THREADS = max(args.sessions, transports.TRANSPORT_THREADS)
+        try:
+            result = asyncio.run(benchmark(args.transports, args.host, os.getenv("USERNAME"), os.getenv("PASSWORD"),
+                                           args.sessions, args.concurrency, args.command))
+        finally:
+            transports.shutdown()
+        print(json.dumps(result))
+        return
+
+    print(f"{'transport':<10} {'sessions/s':>12} {'KB/session':>12}")
+    for transport in args.transports.split(","):
+        try:
+            result = run_alone(args, transport)
+        except Exception as exc:
+            print(f"{transport:<10} failed: {exc}")
+            continue
+        print(f"{transport:<10} {result['sessions_per_second']:>12.1f} {result['memory_per_session_kb']:>12.0f}")
+
+
+if __name__ == "__main__":
+    main()
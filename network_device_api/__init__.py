@@ -0,0 +1,4 @@
+import time
+
+# Taken before anything heavy is imported so the startup metrics cover the whole cold start
+started_at = time.perf_counter()
@@ -0,0 +1,37 @@
+import asyncio, os
+
+BULK_CONCURRENCY = int(os.getenv("BULK_CONCURRENCY", "50"))
+BULK_MAX_CONCURRENCY = int(os.getenv("BULK_MAX_CONCURRENCY", "500"))
+
+
+async def fan_out(items, call, concurrency=BULK_CONCURRENCY):
+    """Run `await call(item)` for every item, at most `concurrency` at a time.
+
+    Yields (item, result, error) tuples in the order they complete. The results queue is bounded
+    so a slow consumer holds the workers back rather than letting results pile up in memory.
+    """
+    items = iter(items)
+    results = asyncio.Queue(maxsize=concurrency)
+
+    async def worker():
+        # Workers share the one iterator, so each item is only ever picked up once
+        for item in items:
+            try:
+                outcome = (item, await call(item), None)
+            except Exception as exc:
+                outcome = (item, None, exc)
+            await results.put(outcome)
+        await results.put(None)
+
+    workers = [asyncio.ensure_future(worker()) for _ in range(concurrency)]
+    try:
+        running = len(workers)
+        while running:
+            outcome = await results.get()
+            if outcome is None:
+                running -= 1
+            else:
+                yield outcome
+    finally:
+        for task in workers:
+            task.cancel()
@@ -0,0 +1,94 @@
+from collections import OrderedDict
+from dataclasses import dataclass
+import os, time
+
+CACHE_MAXSIZE = int(os.getenv("CACHE_MAXSIZE", "1024"))
+CACHE_DEFAULT_TTL = float(os.getenv("CACHE_DEFAULT_TTL", "30"))
+
+# Seconds parsed output stays fresh, matched on the longest prefix of the normalised command
+COMMAND_TTLS = {
+    "show vlan": 60,
+    "show ip interface brief": 30,
+    "show interface": 15,
+    "show run": 300,
+}
+
+
+def normalize_command(command):
+    """Collapse whitespace so 'show  vlan' and 'show vlan' share an entry.
+
+    Case is kept, `| include Vlan10` and `| include vlan10` are different commands.
+    """
+    return " ".join(command.split())
+
+
+@dataclass
+class CacheEntry():
+    value: object
+    stored_at: float
+    ttl: float | None = None
+    version: str | None = None
+
+    def age(self):
+        return time.monotonic() - self.stored_at
+
+    def remaining(self):
+        if self.ttl is None:
+            return float("inf")
+        return max(self.ttl - self.age(), 0)
+
+    def expired(self):
+        return self.ttl is not None and self.age() >= self.ttl
+
+
+class Cache():
+    """Bounded LRU of CacheEntry objects, each with its own TTL. A TTL of None never expires."""
+
+    def __init__(self, maxsize=CACHE_MAXSIZE, default_ttl=CACHE_DEFAULT_TTL, ttls=None):
+        self.maxsize = maxsize
+        self.default_ttl = default_ttl
+        self.ttls = dict(COMMAND_TTLS if ttls is None else ttls)
+        self.cache = OrderedDict()
+
+    def __len__(self):
+        return len(self.cache)
+
+    def ttl_for(self, command):
+        command = normalize_command(command).lower()
+        matches = [prefix for prefix in self.ttls if command.startswith(prefix)]
+        if not matches:
+            return self.default_ttl
+        return self.ttls[max(matches, key=len)]
+
+    def get(self, key):
+        entry = self.cache.get(key)
+        if entry is None:
+            return None
+        if entry.expired():
+            del self.cache[key]
+            return None
+        self.cache.move_to_end(key)
+        return entry
+
+    def set(self, key, value, ttl=None, version=None):
+        entry = CacheEntry(value, time.monotonic(), self.default_ttl if ttl is None else ttl, version)
+        self.cache[key] = entry
+        self.cache.move_to_end(key)
+        while len(self.cache) > self.maxsize:
+            self.cache.popitem(last=False)
+        return entry
+
+    def invalidate(self, match=None):
+        """Drop every key for which match(key) is true, or everything without a match. Returns the count."""
+        if match is None:
+            count = len(self.cache)
+            self.clear()
+            return count
+
+        keys = [key for key in self.cache if match(key)]
+        for key in keys:
+            del self.cache[key]
+        return len(keys)
+
+    def clear(self):
+        self.cache = OrderedDict()
@@ -0,0 +1,105 @@
+from starlette.datastructures import Headers, MutableHeaders
+import os, zlib
+
+try:
+    import zstandard
+except ModuleNotFoundError:
+    zstandard = None
+
+COMPRESS_MIN_SIZE = int(os.getenv("COMPRESS_MIN_SIZE", "1024"))
+COMPRESS_GZIP_LEVEL = int(os.getenv("COMPRESS_GZIP_LEVEL", "6"))
+COMPRESS_ZSTD_LEVEL = int(os.getenv("COMPRESS_ZSTD_LEVEL", "3"))
+
+
+def negotiate(accept_encoding):
+    """Pick zstd (when installed) or gzip from an Accept-Encoding header, None if the client takes neither."""
+    accepted = {}
+    for token in accept_encoding.split(","):
+        name, _, params = token.strip().partition(";")
+        quality = 1.0
+        if params.strip().startswith("q="):
+            try:
+                quality = float(params.strip()[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[name.strip().lower()] = quality
+
+    if zstandard is not None and accepted.get("zstd", 0) > 0:
+        return "zstd"
+    if accepted.get("gzip", 0) > 0:
+        return "gzip"
+    return None
+
+
+class Compressor():
+    def __init__(self, encoding, gzip_level=COMPRESS_GZIP_LEVEL, zstd_level=COMPRESS_ZSTD_LEVEL):
+        if encoding == "zstd":
+            self._compressor = zstandard.ZstdCompressor(level=zstd_level).compressobj()
+            self._sync = zstandard.COMPRESSOBJ_FLUSH_BLOCK
+        else:
+            self._compressor = zlib.compressobj(gzip_level, zlib.DEFLATED, 31)
+            self._sync = zlib.Z_SYNC_FLUSH
+
+    def compress(self, data, final):
+        """Compress a chunk, flushing so the client can decode everything sent so far."""
+        compressed = self._compressor.compress(data)
+        return compressed + (self._compressor.flush() if final else self._compressor.flush(self._sync))
+
+
+class CompressionMiddleware():
+    """Compresses responses of at least minimum_size bytes with zstd or gzip, whichever the client accepts.
+
+    Streaming responses are always compressed and flushed chunk by chunk so NDJSON lines still arrive
+    as soon as they are sent.
+    """
+
+    def __init__(self, app, minimum_size=COMPRESS_MIN_SIZE):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        encoding = negotiate(Headers(scope=scope).get("accept-encoding", ""))
+        if encoding is None:
+            return await self.app(scope, receive, send)
+
+        start, compressor = None, None
+
+        async def compressing_send(message):
+            nonlocal start, compressor
+
+            if message["type"] == "http.response.start":
+                # Held back until the first body chunk shows whether compressing is worth it
+                start = message
+                return
+            if message["type"] != "http.response.body":
+                return await send(message)
+
+            body, more_body = message.get("body", b""), message.get("more_body", False)
+            if start is not None:
+                message_start, start = start, None
+                headers = MutableHeaders(raw=list(message_start["headers"]))
+                if "content-encoding" in headers or message_start["status"] in (204, 304) or \
+                        (not more_body and len(body) < self.minimum_size):
+                    await send(message_start)
+                    return await send(message)
+
+                compressor = Compressor(encoding)
+                body = compressor.compress(body, final=not more_body)
+                headers["Content-Encoding"] = encoding
+                headers.add_vary_header("Accept-Encoding")
+                if more_body:
+                    del headers["Content-Length"]
+                else:
+                    headers["Content-Length"] = str(len(body))
+                message_start["headers"] = headers.raw
+                await send(message_start)
+                return await send({"type": "http.response.body", "body": body, "more_body": more_body})
+
+            if compressor is not None:
+                body = compressor.compress(body, final=not more_body)
+            await send({"type": "http.response.body", "body": body, "more_body": more_body})
+
+        await self.app(scope, receive, compressing_send)
@@ -1,9 +1,13 @@
-from scrapli.driver.core import IOSXEDriver
-from scrapli import response as sresponse
-import os
-
-default_user = os.getenv("IOS_USERNAME")
-default_pass = os.getenv("IOS_PASSWORD")
+from scrapli.exceptions import ScrapliTimeout
+from .cache import normalize_command
+from .inventory import inventory
+from .parsing import async_parse_output, parse_output
+from .pool import pool
+from .singleflight import SingleFlight
+from .transports import ASYNC_TRANSPORTS, SSH_TRANSPORT, SYNC_TRANSPORTS, threaded
+import asyncio, re
+
+flight = SingleFlight()
 # import logging
 
 # # set the name for the logfile and the logging level... thats about it for bare minimum!
@@ -15,29 +19,44 @@ def _test_command(command_output="", host='1.1.1.1', channel_input='show cdp nei
                   failed_when_contains=['% Ambiguous command', '% Incomplete command',
                                         '% Invalid input detected', '% Unknown command'],
                   template=None):
-    """Create Scrapli response from text input without SSH to device."""
-
-    response = sresponse.Response(
-        host, channel_input, textfsm_platform, genie_platform, failed_when_contains)
-    response.result = command_output
+    """Parse text as if it came from a device, without SSH to one. Goes through the same memoized parse
+    stage as real output."""
 
+    structured_result = parse_output(command_output, channel_input, template, genie_platform, textfsm_platform)
     if template:
-        structured_result = response.ttp_parse_output(template)
         return structured_result[0]
 
-    return response.genie_parse_output()
+    # No parser (or nothing parsed) comes back as the raw text, scrapli's genie_parse_output gave []
+    if isinstance(structured_result, str):
+        return []
+    return structured_result
+
+
+def _transport(device, sync=False):
+    transport = device.transport or SSH_TRANSPORT
+    if sync and transport not in SYNC_TRANSPORTS:
+        # The blocking send_command/send_config can't use asyncssh, they fall back to the system transport
+        return "system"
+    return transport
+
+
+def _device_settings(host, username=None, password=None, transport=None):
+    """Driver settings for a host from the inventory, explicit credentials win over the inventory's."""
+    device = inventory.get(host)
+    return device.settings(transport or _transport(device, sync=True), username, password)
 
 
-def send_command(host, command, username=default_user, password=default_pass, template=None, interactive=False):
-    my_device = {
-        "host": host,
-        "auth_username": username,
-        "auth_password": password,
-        "auth_strict_key": False,
-        "ssh_config_file": "ssh_config",
-    }
+def _async_session(host, username=None, password=None):
+    """(settings, driver class, max sessions) for a pooled session, blocking transports are wrapped to run on threads."""
+    device = inventory.get(host)
+    transport = _transport(device)
+    driver = device.async_driver if transport in ASYNC_TRANSPORTS else threaded(device.driver)
+    return device.settings(transport, username, password), driver, device.max_sessions
 
-    with IOSXEDriver(**my_device) as conn:
+
+def send_command(host, command, username=None, password=None, template=None, interactive=False):
+    device = inventory.get(host)
+    with device.driver(**_device_settings(host, username, password)) as conn:
         # Enter interactive mode
         if interactive:
             response = conn.send_interactive(command)
@@ -53,29 +72,12 @@ def send_command(host, command, username=default_user, password=default_pass, te
         else:
             response = conn.send_command(command)
 
-        if template:
-            structured_result = response.ttp_parse_output(template)
-            return structured_result
-
-        else:
-            structured_result = response.genie_parse_output()
-            if len(structured_result) == 0:
-                return response.result
-
-            else:
-                return structured_result
-
+        return parse_output(response.result, response.channel_input, template,
+                            device.genie_platform, response.textfsm_platform)
 
-def send_config(host, config, username=default_user, password=default_pass, interactive=False):
-    my_device = {
-        "host": host,
-        "auth_username": username,
-        "auth_password": password,
-        "auth_strict_key": False,
-        "ssh_config_file": "ssh_config",
-    }
 
-    with IOSXEDriver(**my_device) as conn:
+def send_config(host, config, username=None, password=None, interactive=False):
+    with inventory.get(host).driver(**_device_settings(host, username, password)) as conn:
         if interactive:
             response = conn.send_interactive(
                 config, privilege_level="configuration")
@@ -95,6 +97,107 @@ def send_config(host, config, username=default_user, password=default_pass, inte
         return response
 
 
+async def async_send_command(host, command, username=None, password=None, template=None, interactive=False):
+    """Same as send_command but over a pooled session, so the event loop is never blocked on the device.
+
+    Concurrent identical show commands share a single device call. Only whitespace is ignored when
+    comparing them, `| include Vlan10` and `| include vlan10` each get their own.
+    """
+    if interactive:
+        return await _async_send_command(host, command, username, password, template, interactive)
+
+    key = (inventory.get(host).host, username, normalize_command(command), template)
+    return await flight.do(key, _async_send_command, host, command, username, password, template)
+
+
+async def _async_send_command(host, command, username, password, template=None, interactive=False):
+    async def _send(conn):
+        if interactive:
+            return await conn.send_interactive(command)
+        return await conn.send_command(command)
+
+    settings, driver, max_sessions = _async_session(host, username, password)
+    response = await pool.run(settings, driver, _send, max_sessions)
+    # Parsed outside pool.run so the session is handed back before the CPU heavy part starts
+    return await async_parse_output(response.result, response.channel_input, template,
+                                    inventory.get(host).genie_platform, response.textfsm_platform)
+
+
+async def async_send_commands(host, commands, username=None, password=None):
+    """Run several show commands over one pooled session, returning their parsed results in order."""
+    async def _send(conn):
+        return await conn.send_commands(commands)
+
+    settings, driver, max_sessions = _async_session(host, username, password)
+    responses = await pool.run(settings, driver, _send, max_sessions)
+    genie_platform = inventory.get(host).genie_platform
+    return await asyncio.gather(*[
+        async_parse_output(response.result, response.channel_input, None,
+                           genie_platform, response.textfsm_platform)
+        for response in responses
+    ])
+
+
+async def async_stream_command(host, command, username=None, password=None):
+    """Yield a command's raw output in chunks as the device sends it, for outputs too big to hold in memory.
+
+    Only the current partial line is kept back, to drop the echoed command and spot the prompt at the end.
+    Nothing is parsed or cached.
+    """
+    settings, driver, max_sessions = _async_session(host, username, password)
+    async with pool.session(settings, driver, max_sessions) as conn:
+        # A pooled session may have been left in configuration mode by a config push
+        await conn.acquire_priv(conn.default_desired_privilege_level)
+        prompt = re.compile(conn.comms_prompt_pattern.encode(), flags=re.M | re.I)
+        conn.channel.write(command)
+        conn.channel.send_return()
+
+        echoed, pending = False, b""
+        while True:
+            try:
+                pending += await asyncio.wait_for(conn.channel.read(), conn.timeout_ops)
+            except asyncio.TimeoutError:
+                raise ScrapliTimeout(f"No output from {host} for {conn.timeout_ops}s") from None
+
+            if not echoed:
+                if b"\n" not in pending:
+                    continue
+                pending = pending.split(b"\n", 1)[1]
+                echoed = True
+
+            lines, newline, pending = pending.rpartition(b"\n")
+            if newline:
+                yield lines + newline
+            if prompt.search(pending.strip()):
+                return
+
+
+async def async_send_config(host, config, username=None, password=None, interactive=False):
+    """Same as send_config but over a pooled session."""
+    async def _send(conn):
+        if interactive:
+            return await conn.send_interactive(config, privilege_level="configuration")
+        return await conn.send_config(config)
+
+    settings, driver, max_sessions = _async_session(host, username, password)
+    response = await pool.run(settings, driver, _send, max_sessions)
+    if response.failed:
+        return response.result
+    return response
+
+
+async def async_send_configs(host, configs, username=None, password=None, stop_on_failed=False):
+    """Push a list of config lines over one pooled session, returning scrapli's MultiResponse (one per line).
+
+    With stop_on_failed nothing after the first failing line is sent, so the MultiResponse is shorter.
+    """
+    async def _send(conn):
+        return await conn.send_configs(configs, stop_on_failed=stop_on_failed)
+
+    settings, driver, max_sessions = _async_session(host, username, password)
+    return await pool.run(settings, driver, _send, max_sessions)
+
+
 if __name__ == "__main__":
     # print(send_config("10.3.120.138", ""))
     # print(len(send_command("10.3.120.138", "show switch").get("switch").get("stack").keys()))
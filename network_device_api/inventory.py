@@ -0,0 +1,186 @@
+from contextlib import closing
+from dataclasses import dataclass, field, fields
+from pathlib import Path
+from scrapli.driver import core
+from .transports import check_transport
+import os, sqlite3, yaml
+
+# YAML (.yml/.yaml) or SQLite file describing the devices, loaded once at import
+INVENTORY_FILE = os.getenv("INVENTORY_FILE", "")
+# Used for devices without their own credentials, including any not in the inventory at all
+DEFAULT_USERNAME = os.getenv("USERNAME") or os.getenv("IOS_USERNAME")
+DEFAULT_PASSWORD = os.getenv("PASSWORD") or os.getenv("IOS_PASSWORD")
+DEFAULT_PLATFORM = os.getenv("DEFAULT_PLATFORM", "cisco_iosxe")
+
+
+@dataclass(frozen=True)
+class Platform():
+    driver: type
+    async_driver: type
+    genie_platform: str
+
+
+PLATFORMS = {
+    "cisco_iosxe": Platform(core.IOSXEDriver, core.AsyncIOSXEDriver, "iosxe"),
+    "cisco_iosxr": Platform(core.IOSXRDriver, core.AsyncIOSXRDriver, "iosxr"),
+    "cisco_nxos": Platform(core.NXOSDriver, core.AsyncNXOSDriver, "nxos"),
+    "arista_eos": Platform(core.EOSDriver, core.AsyncEOSDriver, "eos"),
+    "juniper_junos": Platform(core.JunosDriver, core.AsyncJunosDriver, "junos"),
+}
+
+
+@dataclass(frozen=True)
+class Device():
+    host: str
+    name: str | None = None
+    platform: str = DEFAULT_PLATFORM
+    username: str | None = DEFAULT_USERNAME
+    password: str | None = field(default=DEFAULT_PASSWORD, repr=False)
+    port: int = 22
+    transport: str | None = None
+    timeout_socket: float | None = None
+    timeout_transport: float | None = None
+    timeout_ops: float | None = None
+    max_sessions: int | None = None
+    auth_strict_key: bool = False
+    ssh_config_file: str = "ssh_config"
+    tags: frozenset = frozenset()
+
+    def __post_init__(self):
+        if self.platform not in PLATFORMS:
+            raise ValueError(f"{self.name or self.host}: unknown platform {self.platform}, expected one of {', '.join(PLATFORMS)}")
+        if self.transport is not None:
+            try:
+                check_transport(self.transport)
+            except ValueError as exc:
+                raise ValueError(f"{self.name or self.host}: {exc}") from None
+
+    @property
+    def driver(self):
+        return PLATFORMS[self.platform].driver
+
+    @property
+    def async_driver(self):
+        return PLATFORMS[self.platform].async_driver
+
+    @property
+    def genie_platform(self):
+        return PLATFORMS[self.platform].genie_platform
+
+    def settings(self, transport, username=None, password=None):
+        """Keyword arguments for the scrapli driver, explicit credentials win over the inventory's."""
+        settings = {
+            "host": self.host,
+            "port": self.port,
+            "auth_username": username or self.username,
+            "auth_password": password or self.password,
+            "auth_strict_key": self.auth_strict_key,
+            "ssh_config_file": self.ssh_config_file,
+            "transport": transport,
+        }
+        for timeout in ("timeout_socket", "timeout_transport", "timeout_ops"):
+            if getattr(self, timeout) is not None:
+                settings[timeout] = getattr(self, timeout)
+        return settings
+
+    def as_dict(self):
+        return {
+            "name": self.name,
+            "host": self.host,
+            "platform": self.platform,
+            "port": self.port,
+            "transport": self.transport,
+            "tags": sorted(self.tags),
+        }
+
+
+DEVICE_FIELDS = {device_field.name for device_field in fields(Device)}
+
+
+def make_device(name, values, defaults=None):
+    """Build a Device from an inventory entry, `host` defaulting to the name and credentials able to
+    come from the environment ("$SWITCH_PASSWORD")."""
+    values = {**(defaults or {}), **{key: value for key, value in values.items() if value is not None}}
+    unknown = set(values) - DEVICE_FIELDS
+    if unknown:
+        raise ValueError(f"{name}: unknown inventory fields {', '.join(sorted(unknown))}")
+
+    tags = values.get("tags") or ()
+    values["tags"] = frozenset(tag.strip() for tag in tags.split(",")) if isinstance(tags, str) else frozenset(tags)
+    for credential in ("username", "password"):
+        if isinstance(values.get(credential), str):
+            values[credential] = os.path.expandvars(values[credential])
+    return Device(**{"host": name, **values, "name": name})
+
+
+class Inventory():
+    """Devices indexed by both name and address, plus an index of which devices carry each tag.
+
+    Hosts that aren't in the inventory get a default device (the environment's credentials on
+    DEFAULT_PLATFORM), so an empty inventory behaves exactly like no inventory.
+    """
+
+    def __init__(self, devices=()):
+        self.devices = {}
+        self.by_tag = {}
+        for device in devices:
+            self.add(device)
+
+    def __len__(self):
+        return len({device.host for device in self.devices.values()})
+
+    def __contains__(self, host):
+        return host in self.devices
+
+    def add(self, device):
+        for key in {device.host, device.name} - {None}:
+            self.devices[key] = device
+        for tag in device.tags:
+            self.by_tag.setdefault(tag, {})[device.name or device.host] = device
+
+    def get(self, host):
+        device = self.devices.get(host)
+        if device is None:
+            return Device(host)
+        return device
+
+    def tagged(self, tags):
+        """Names of the devices carrying every one of tags."""
+        if not tags:
+            return []
+        return [name for name in self.by_tag.get(tags[0], {})
+                if all(name in self.by_tag.get(tag, {}) for tag in tags[1:])]
+
+    def all(self):
+        return list({device.host: device for device in self.devices.values()}.values())
+
+    def genie_platforms(self):
+        """Genie platforms in use, including the default one given to hosts outside the inventory."""
+        platforms = {PLATFORMS[DEFAULT_PLATFORM].genie_platform}
+        return tuple(sorted(platforms | {device.genie_platform for device in self.all()}))
+
+    @classmethod
+    def from_yaml(cls, path):
+        """devices: {name: {host, platform, username, password, tags, ...}} with optional shared defaults:."""
+        data = yaml.safe_load(Path(path).read_text()) or {}
+        defaults = data.get("defaults") or {}
+        return cls(make_device(str(name), values or {}, defaults) for name, values in (data.get("devices") or {}).items())
+
+    @classmethod
+    def from_sqlite(cls, path):
+        """A devices table with a name column and any of the Device fields, tags comma separated."""
+        with closing(sqlite3.connect(path)) as db:
+            db.row_factory = sqlite3.Row
+            rows = db.execute("SELECT * FROM devices").fetchall()
+        return cls(make_device(row["name"], {key: row[key] for key in row.keys() if key != "name"}) for row in rows)
+
+    @classmethod
+    def load(cls, path=INVENTORY_FILE):
+        if not path:
+            return cls()
+        if Path(path).suffix in (".yml", ".yaml"):
+            return cls.from_yaml(path)
+        return cls.from_sqlite(path)
+
+
+inventory = Inventory.load()
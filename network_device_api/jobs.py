@@ -0,0 +1,157 @@
+from dataclasses import dataclass, field
+import asyncio, os, time, uuid
+
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))
+JOB_TIMEOUT = float(os.getenv("JOB_TIMEOUT", "900"))
+JOB_RETENTION = float(os.getenv("JOB_RETENTION", "3600"))
+
+PENDING, RUNNING, SUCCEEDED, FAILED, CANCELLED, TIMED_OUT = \
+    "pending", "running", "succeeded", "failed", "cancelled", "timed_out"
+FINISHED = (SUCCEEDED, FAILED, CANCELLED, TIMED_OUT)
+
+
+@dataclass
+class Job():
+    id: str
+    name: str
+    operation: object = field(repr=False)
+    timeout: float = JOB_TIMEOUT
+    status: str = PENDING
+    result: object = None
+    error: str | None = None
+    created_at: float = field(default_factory=time.time)
+    started_at: float | None = None
+    finished_at: float | None = None
+    task: asyncio.Task | None = field(default=None, repr=False)
+    changed: asyncio.Event = field(default_factory=asyncio.Event, repr=False)
+
+    def done(self):
+        return self.status in FINISHED
+
+    def update(self, status, **fields):
+        self.status = status
+        for name, value in fields.items():
+            setattr(self, name, value)
+        # Wake everyone watching, then start a fresh event for the next change
+        self.changed.set()
+        self.changed = asyncio.Event()
+
+    def as_dict(self):
+        return {
+            "id": self.id,
+            "name": self.name,
+            "status": self.status,
+            "result": self.result,
+            "error": self.error,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+
+class JobManager():
+    """Runs long operations on a fixed number of workers so HTTP requests only submit and poll them.
+
+    Finished jobs are kept for `retention` seconds so clients can collect their results.
+    """
+
+    def __init__(self, workers=JOB_WORKERS, timeout=JOB_TIMEOUT, retention=JOB_RETENTION, describe_error=None):
+        self.workers = workers
+        self.timeout = timeout
+        self.retention = retention
+        self.describe_error = describe_error or (lambda exc: f"{type(exc).__name__}: {exc}")
+        self.jobs = {}
+        self._queue = None
+        self._workers = []
+        self._loop = None
+
+    def _ensure_started(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is loop:
+            return
+        self._loop = loop
+        self._queue = asyncio.Queue()
+        self._workers = [asyncio.ensure_future(self._work()) for _ in range(self.workers)]
+        # Anything still pending was queued on a loop that is gone, requeue it on this one
+        for job in self.jobs.values():
+            if job.status == PENDING:
+                self._queue.put_nowait(job)
+
+    def _purge(self):
+        now = time.time()
+        expired = [job_id for job_id, job in self.jobs.items()
+                   if job.done() and now - job.finished_at > self.retention]
+        for job_id in expired:
+            del self.jobs[job_id]
+
+    def submit(self, name, operation, timeout=None):
+        """Queue `await operation()` to run as a job and return it straight away."""
+        self._ensure_started()
+        self._purge()
+        job = Job(uuid.uuid4().hex, name, operation, timeout or self.timeout)
+        self.jobs[job.id] = job
+        self._queue.put_nowait(job)
+        return job
+
+    def get(self, job_id):
+        self._purge()
+        return self.jobs.get(job_id)
+
+    def cancel(self, job_id):
+        job = self.get(job_id)
+        if job is None or job.done():
+            return job
+        if job.task is not None:
+            job.task.cancel()
+        else:
+            job.update(CANCELLED, finished_at=time.time())
+        return job
+
+    async def wait(self, job, timeout):
+        """Wait up to timeout seconds for the job to finish, returning it either way."""
+        deadline = time.monotonic() + timeout
+        while not job.done() and (remaining := deadline - time.monotonic()) > 0:
+            try:
+                await asyncio.wait_for(job.changed.wait(), remaining)
+            except asyncio.TimeoutError:
+                break
+        return job
+
+    async def watch(self, job):
+        """Yield the job every time its status changes, finishing once it is done."""
+        while True:
+            changed = job.changed
+            yield job
+            if job.done():
+                return
+            await changed.wait()
+
+    async def _work(self):
+        while True:
+            job = await self._queue.get()
+            if job.status != PENDING:
+                continue
+
+            job.task = asyncio.ensure_future(asyncio.wait_for(job.operation(), job.timeout))
+            job.update(RUNNING, started_at=time.time())
+            try:
+                await asyncio.wait({job.task})
+            finally:
+                # The worker itself is being shut down, take the job down with it
+                job.task.cancel()
+
+            if job.task.cancelled():
+                job.update(CANCELLED, finished_at=time.time())
+            elif isinstance(job.task.exception(), asyncio.TimeoutError):
+                job.update(TIMED_OUT, finished_at=time.time(), error=f"Job timed out after {job.timeout}s")
+            elif job.task.exception() is not None:
+                job.update(FAILED, finished_at=time.time(), error=self.describe_error(job.task.exception()))
+            else:
+                job.update(SUCCEEDED, finished_at=time.time(), result=job.task.result())
+
+    async def close(self):
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        self._loop = None
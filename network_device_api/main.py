@@ -1,27 +1,290 @@
-from fastapi import FastAPI, HTTPException
-from pydantic import BaseModel
-from .connect_device import send_command, send_config
-import scrapli, os
+from fastapi import Depends, FastAPI, HTTPException, Query, Request, Response
+from fastapi.responses import JSONResponse, ORJSONResponse, StreamingResponse
+from pydantic import BaseModel, Field, root_validator, validator
+from .bulk import BULK_CONCURRENCY, BULK_MAX_CONCURRENCY, fan_out
+from .cache import Cache, normalize_command
+from .compression import CompressionMiddleware
+from .inventory import inventory
+from .jobs import JobManager
+from .offline_parse import OFFLINE_PARSE_CONCURRENCY, OFFLINE_PARSE_MAX_BODY, BodyTooLarge, parse_records, read_records, spool
+from .connect_device import async_send_command, async_send_commands, async_send_config, async_send_configs, async_stream_command
+from .poller import Poller
+from .pagination import Page, paginate
+from .pool import DeviceBusy, pool
+from .projection import Projection
+from .snapshots import SnapshotStore, content_hash, diff
+from .templates import TTP_TEMPLATE_UPLOADS, TemplateRegistry, check_upload
+from . import parsing, transports, started_at
+import scrapli, asyncio, logging, math, orjson, time
+
+logger = logging.getLogger(__name__)
+
+# Parsed output is already plain JSON types, so it is rendered with orjson rather than walked by jsonable_encoder
+app = FastAPI(default_response_class=ORJSONResponse)
+app.add_middleware(CompressionMiddleware)
+cache = Cache()
+snapshots = SnapshotStore()
+templates = TemplateRegistry()
+startup_metrics = {"import_seconds": time.perf_counter() - started_at}
+
+# Concrete examples of every command the routes send, used to prewarm their parsers
+PREWARM_COMMANDS = [example for _, example in parsing.SUPPORTED_COMMANDS]
+
+
+@app.on_event("startup")
+async def start_pool_reaper():
+    app.state.pool_reaper = asyncio.create_task(pool.reap())
+
+@app.on_event("startup")
+async def start_poller():
+    poller.start()
+
+@app.on_event("startup")
+async def prewarm_parsers():
+    if parsing.PARSE_PREWARM:
+        prewarm_started = time.perf_counter()
+        startup_metrics["prewarmed_commands"] = await parsing.async_prewarm(PREWARM_COMMANDS, inventory.genie_platforms())
+        startup_metrics["prewarm_seconds"] = time.perf_counter() - prewarm_started
+
+    startup_metrics["ready_seconds"] = time.perf_counter() - started_at
+    logger.info(f"startup complete: {startup_metrics}")
+
+@app.on_event("shutdown")
+async def shutdown():
+    app.state.pool_reaper.cancel()
+    await poller.stop()
+    await jobs.close()
+    await pool.close()
+    parsing.shutdown()
+    transports.shutdown()
+
+
+@app.exception_handler(DeviceBusy)
+async def device_busy(request: Request, exc: DeviceBusy):
+    """Too many queued requests is the client's problem (429), waiting too long for a session is ours (503)."""
+    return JSONResponse(
+        status_code=429 if exc.queue_full else 503,
+        content={"detail": str(exc)},
+        headers={"Retry-After": str(exc.retry_after)}
+    )
+
+@app.exception_handler(scrapli.exceptions.ScrapliTimeout)
+async def device_timeout(request: Request, exc):
+    return JSONResponse(
+        status_code=504,
+        content={"detail": "Timed out waiting for the device to respond"}
+    )
+
+
+def device_host(device_ip):
+    """The address output is cached under, so a device named by address or by inventory name shares entries."""
+    return inventory.get(device_ip).host
+
+def cache_key(device_ip, command, template=None):
+    return (device_host(device_ip), normalize_command(command), template)
+
+def wants_fresh(request: Request):
+    """Clients can skip the cache with a `Cache-Control: no-cache` request header."""
+    return "no-cache" in request.headers.get("cache-control", "")
+
+def store_result(device_ip, command, detail, template=None, ttl=None):
+    """Cache freshly parsed output and snapshot its version, returning its cache entry."""
+    key = cache_key(device_ip, command, template)
+    version = content_hash(detail)
+    snapshots.add(key, version, detail)
+    return cache.set(key, detail, ttl=ttl or cache.ttl_for(command), version=version)
+
+async def fetch(device_ip, command, template=None, refresh=False):
+    """Return the cache entry for a show command, running it on the device on a miss.
+
+    `template` is a registered TTP Template, output parsed with it is cached under its digest so a
+    re-uploaded template never serves output parsed with the old one.
+    """
+    digest = template.digest if template else None
+    entry = None if refresh else cache.get(cache_key(device_ip, command, digest))
+    if entry is None:
+        detail = await async_send_command(device_ip, command, template=template.text if template else None)
+        entry = store_result(device_ip, command, detail, digest)
+    return entry
+
+async def refresh_device(device_ip, commands):
+    """Poller callback, refreshes every command for a device over one session."""
+    results = await async_send_commands(device_ip, commands)
+    for command, detail in zip(commands, results):
+        # Outlive the next poll so readers never find the entry expired in between
+        store_result(device_ip, command, detail, ttl=max(cache.ttl_for(command), 2 * poller.interval))
+
+poller = Poller(refresh_device)
+
+def invalidate_device(device_ip):
+    host = device_host(device_ip)
+    return cache.invalidate(lambda key: key[0] == host)
+
+def projection(fields: str | None = None, exclude: str | None = None, where: str | None = None):
+    """Dependency for the show routes' fields/exclude/where query parameters."""
+    try:
+        return Projection(fields, exclude, where)
+    except ValueError as exc:
+        raise HTTPException(
+            status_code=400,
+            detail=str(exc)
+        )
+
+def pagination(limit: int | None = Query(None, ge=1), cursor: str | None = None):
+    """Dependency for the show routes' limit/cursor query parameters."""
+    try:
+        return Page(limit, cursor)
+    except ValueError as exc:
+        raise HTTPException(
+            status_code=400,
+            detail=str(exc)
+        )
+
+def entity_tag(entry, projected=None):
+    """A projected body differs from the full one, so its ETag has to as well."""
+    if not projected:
+        return entry.version
+    return f"{entry.version}-{content_hash(projected.key)[:8]}"
+
+def entry_headers(entry, projected=None):
+    return {
+        "Cache-Control": f"max-age={math.ceil(entry.remaining())}",
+        "Age": str(int(entry.age())),
+        "ETag": f'"{entity_tag(entry, projected)}"',
+        "X-Snapshot-Version": entry.version,
+    }
+
+def not_modified(request: Request, entry, projected=None):
+    """True if the client's If-None-Match already names this version of the output."""
+    tags = request.headers.get("if-none-match")
+    if not tags:
+        return False
+    return tags.strip() == "*" or \
+        entity_tag(entry, projected) in {tag.strip().removeprefix("W/").strip('"') for tag in tags.split(",")}
+
+def show_response(request: Request, device_ip, command, entry, since=None, projected=None):
+    """Body for a show route, just what changed if the client sent a version it already has.
+
+    A client that already holds this exact version gets a bare 304, so a cached entry is answered
+    without touching the device or serializing anything. Anything else is returned as an ORJSONResponse
+    directly so FastAPI doesn't run jsonable_encoder over large parsed outputs.
+
+    `projected` narrows the output (and both sides of a diff) to what the client asked for.
+    """
+    headers = entry_headers(entry, projected)
+    if not_modified(request, entry, projected):
+        return Response(status_code=304, headers=headers)
+
+    project = projected.apply if projected else lambda value: value
+
+    if since:
+        previous = snapshots.get(cache_key(device_ip, command), since.removeprefix("W/").strip('"'))
+        # An unknown or expired version falls through to the full output
+        if previous is not None:
+            return ORJSONResponse({
+                "message": "Command executed sucessfully",
+                "version": entry.version,
+                "since": since,
+                "diff": diff(project(previous), project(entry.value))
+            }, headers=headers)
+
+    return ORJSONResponse({
+        "message": "Command executed sucessfully",
+        "detail": project(entry.value)
+    }, headers=headers)
+
+def page_response(value, version, page, projected=None, headers=None):
+    """One page of a show route's output, with the cursor for the next page if there is one."""
+    if projected:
+        value = projected.apply(value)
+    detail, next_offset, total = paginate(value, page.offset, page.limit)
+    return ORJSONResponse({
+        "message": "Command executed sucessfully",
+        "version": version,
+        "total": total,
+        "next": Page.cursor(version, next_offset),
+        "detail": detail
+    }, headers={**(headers or {}), "X-Snapshot-Version": version})
+
+async def show(request: Request, device_ip, command, since=None, projected=None, page=None):
+    """Fetch a show command's output and respond with it, or with the page of it asked for.
+
+    Pages after the first are served from the snapshot named in the cursor rather than the device,
+    so every page comes from the same consistent version of the output.
+    """
+    if page and since:
+        raise HTTPException(
+            status_code=400,
+            detail='since cannot be combined with limit or cursor'
+        )
+
+    if page and page.version:
+        value = snapshots.get(cache_key(device_ip, command), page.version)
+        if value is None:
+            raise HTTPException(
+                status_code=410,
+                detail='Snapshot for this cursor has expired, start again without a cursor'
+            )
+        return page_response(value, page.version, page, projected)
 
-app = FastAPI()
+    entry = await fetch(device_ip, command, refresh=wants_fresh(request))
+    if page:
+        headers = entry_headers(entry)
+        del headers["ETag"]
+        return page_response(entry.value, entry.version, page, projected, headers)
+    return show_response(request, device_ip, command, entry, since, projected)
 
 
 @app.get("/")
 async def api_version():
     return {"message": "Network Device API"}
 
+@app.get("/metrics/startup/")
+async def show_startup_metrics():
+    """Cold start timings: module import, parser prewarm and total time until ready to serve."""
+    return {
+        "message": "Startup metrics",
+        "detail": startup_metrics
+    }
+
+@app.get("/poller/")
+async def show_poller():
+    """Which devices and commands are kept warm in the background and how the last round went."""
+    return {
+        "message": "Poller status",
+        "detail": poller.status()
+    }
+
+@app.get("/inventory/")
+async def show_inventory(tag: list[str] = Query([])):
+    """Devices in the inventory, only those carrying every given tag if any are."""
+    devices = inventory.all()
+    if tag:
+        names = set(inventory.tagged(tag))
+        devices = [device for device in devices if device.name in names]
+    return {
+        "message": "Inventory",
+        "detail": [device.as_dict() for device in devices]
+    }
+
+@app.get("/supported-commands/")
+async def check_supported_show_commands():
+    """Commands with a precomputed parser, anything else is parsed by Genie's own lookup if it can be."""
+    return {
+        "message": "Supported commands",
+        "detail": PREWARM_COMMANDS
+    }
+
 @app.get("/{device_ip}/vlans/")
-async def show_vlans(device_ip, vlan_id=None):
+async def show_vlans(device_ip, request: Request, vlan_id=None, since=None,
+        projected: Projection = Depends(projection), page: Page = Depends(pagination)):
     if vlan_id:
         command = f'show vlan id {vlan_id}'
     else:
         command = 'show vlan'
 
     try:
-        return {    
-            "message": "Command executed sucessfully",
-            "detail": send_command(device_ip, command, username=os.getenv("USERNAME"), password=os.getenv("PASSWORD"))
-        }
+        return await show(request, device_ip, command, since, projected, page)
 
     except scrapli.exceptions.ScrapliAuthenticationFailed:
         raise HTTPException(
@@ -30,13 +293,11 @@ async def show_vlans(device_ip, vlan_id=None):
         )
 
 @app.get("/{device_ip}/ip-interfaces/")
-async def show_ip_interfaces(device_ip):
+async def show_ip_interfaces(device_ip, request: Request, since=None,
+        projected: Projection = Depends(projection), page: Page = Depends(pagination)):
     command = "show ip interface brief"
     try:
-        return {    
-            "message": "Command executed sucessfully",
-            "detail": send_command(device_ip, command, username=os.getenv("USERNAME"), password=os.getenv("PASSWORD"))      
-        }
+        return await show(request, device_ip, command, since, projected, page)
     except scrapli.exceptions.ScrapliAuthenticationFailed:
         raise HTTPException(
             status_code=404,
@@ -44,16 +305,14 @@ async def show_ip_interfaces(device_ip):
         )
 
 @app.get("/{device_ip}/interfaces/")
-async def show_interfaces(device_ip, interface_name=None):
+async def show_interfaces(device_ip, request: Request, interface_name=None, since=None,
+        projected: Projection = Depends(projection), page: Page = Depends(pagination)):
     if interface_name:
         command = f"show interface {interface_name}"
     else:
         command = "show interfaces"
     try:
-        return {    
-            "message": "Command executed sucessfully",
-            "detail": send_command(device_ip, command, username=os.getenv("USERNAME"), password=os.getenv("PASSWORD"))             
-        }
+        return await show(request, device_ip, command, since, projected, page)
     except scrapli.exceptions.ScrapliAuthenticationFailed:
         raise HTTPException(
             status_code=404,
@@ -61,7 +320,8 @@ async def show_interfaces(device_ip, interface_name=None):
         )
 
 @app.get("/{device_ip}/interfaces-config/")
-async def show_run_interface(device_ip, interface_name=None):
+async def show_run_interface(device_ip, request: Request, interface_name=None, since=None,
+        projected: Projection = Depends(projection), page: Page = Depends(pagination)):
     if not interface_name:
         raise HTTPException(
             status_code=404,
@@ -71,16 +331,40 @@ async def show_run_interface(device_ip, interface_name=None):
         command = f"show run interface {interface_name}"
 
     try:
-        return {    
-            "message": "Command executed sucessfully",
-            "detail": send_command(device_ip, command, username=os.getenv("USERNAME"), password=os.getenv("PASSWORD"))             
-        }
+        return await show(request, device_ip, command, since, projected, page)
     except scrapli.exceptions.ScrapliAuthenticationFailed:
         raise HTTPException(
             status_code=404,
             detail='Timed out connecting to host, does it exist?'
         )
 
+@app.get("/{device_ip}/raw/")
+async def stream_raw_command(device_ip, command: str):
+    """Stream a show command's unparsed output as the device sends it, for huge outputs like show tech-support."""
+    try:
+        show_command(command)
+    except ValueError as exc:
+        raise HTTPException(
+            status_code=400,
+            detail=str(exc)
+        )
+
+    chunks = async_stream_command(device_ip, command)
+    try:
+        # Wait for the first chunk so connection errors still get a proper status code
+        first = await anext(chunks, b"")
+    except scrapli.exceptions.ScrapliAuthenticationFailed:
+        raise HTTPException(
+            status_code=404,
+            detail='Timed out connecting to host, does it exist?'
+        )
+
+    async def output():
+        yield first
+        async for chunk in chunks:
+            yield chunk
+
+    return StreamingResponse(output(), media_type="text/plain")
 
 class Interface(BaseModel):
     name: str
@@ -107,7 +391,8 @@ def config_templates(config_model: ConfigCommands):
 @app.post("/{device_ip}/interfaces/", status_code=201)
 async def configure_interface(device_ip, interface: Interface):
     try:
-        send_config(device_ip, config_templates(interface), username=os.getenv("USERNAME"), password=os.getenv("PASSWORD"))
+        await async_send_config(device_ip, config_templates(interface))
+        invalidate_device(device_ip)
 
         return {
             "message": "Config changed sucessfully"
@@ -119,75 +404,348 @@ async def configure_interface(device_ip, interface: Interface):
             detail='Timed out connecting to host, does it exist?'
         )
 
+async def push_interfaces(device_ip, interfaces, stop_on_failure=False):
+    """Render many interfaces into one config block and push it over a single session.
+
+    Each interface is reported as configured, failed or skipped (not sent because an earlier one failed
+    with stop_on_failure set).
+    """
+    blocks = [config_templates(interface).splitlines() for interface in interfaces]
+    responses = await async_send_configs(
+        device_ip, [line for block in blocks for line in block], stop_on_failed=stop_on_failure)
+    invalidate_device(device_ip)
+
+    results, position = [], 0
+    for interface, block in zip(interfaces, blocks):
+        sent = responses[position:position + len(block)]
+        position += len(block)
+        failed = [line for line in sent if line.failed]
+        if failed:
+            results.append({"name": interface.name, "status": "failed", "detail": "\n".join(line.result for line in failed)})
+        elif len(sent) < len(block):
+            results.append({"name": interface.name, "status": "skipped"})
+        else:
+            results.append({"name": interface.name, "status": "configured"})
+    return results
+
+@app.post("/{device_ip}/interfaces/batch/", status_code=201)
+async def configure_interfaces(device_ip, response: Response, interfaces: list[Interface], stop_on_failure: bool = False):
+    """Push many interfaces in one session, anything short of all configured returns 207."""
+    try:
+        results = await push_interfaces(device_ip, interfaces, stop_on_failure)
+    except scrapli.exceptions.ScrapliAuthenticationFailed:
+        raise HTTPException(
+            status_code=404,
+            detail='Timed out connecting to host, does it exist?'
+        )
+
+    if any(result["status"] != "configured" for result in results):
+        response.status_code = 207
+        message = "Config partially failed"
+    else:
+        message = "Config changed sucessfully"
+
+    return {
+        "message": message,
+        "detail": results
+    }
+
+
+def single_line(command):
+    """Validator refusing control characters, a newline or carriage return would send the device a second command."""
+    if not command.isprintable():
+        raise ValueError("commands can't contain newlines or other control characters")
+    return command
+
+def show_command(command):
+    """Validator for commands taken from request bodies, nothing but show commands gets near a device."""
+    single_line(command)
+    if not normalize_command(command).lower().startswith("show "):
+        raise ValueError("only show commands are allowed")
+    return command
+
+class Commands(BaseModel):
+    commands: list[str] = Field(..., min_items=1)
+
+    _show_commands_only = validator("commands", each_item=True, allow_reuse=True)(show_command)
+
+@app.post("/{device_ip}/commands/")
+async def show_commands(device_ip, request: Request, body: Commands):
+    """Run several show commands over a single session, e.g. a vlan/interface/neighbor snapshot."""
+    refresh = wants_fresh(request)
+    commands = list(dict.fromkeys(body.commands))
+    entries = {command: None if refresh else cache.get(cache_key(device_ip, command)) for command in commands}
+    missing = [command for command, entry in entries.items() if entry is None]
+
+    try:
+        if missing:
+            results = await async_send_commands(device_ip, missing)
+            for command, detail in zip(missing, results):
+                entries[command] = store_result(device_ip, command, detail)
+
+        return ORJSONResponse({
+            "message": "Command executed sucessfully",
+            "detail": {command: entry.value for command, entry in entries.items()}
+        })
+    except scrapli.exceptions.ScrapliAuthenticationFailed:
+        raise HTTPException(
+            status_code=404,
+            detail='Timed out connecting to host, does it exist?'
+        )
+
+
+class BulkTargets(BaseModel):
+    # Addresses or inventory names, plus every inventory device carrying all of tags
+    hosts: list[str] = []
+    tags: list[str] = []
+
+    @root_validator(skip_on_failure=True)
+    def some_devices(cls, values):
+        if not values["hosts"] and not values["tags"]:
+            raise ValueError("give hosts, tags or both")
+        if not values["hosts"] and not inventory.tagged(values["tags"]):
+            raise ValueError(f"no devices in the inventory are tagged {', '.join(values['tags'])}")
+        return values
+
+    def targets(self):
+        return dict.fromkeys(self.hosts + inventory.tagged(self.tags))
+
+class BulkCommand(BulkTargets):
+    command: str
+    template: str | None = None
+    concurrency: int = Field(BULK_CONCURRENCY, ge=1, le=BULK_MAX_CONCURRENCY)
+
+    _show_commands_only = validator("command", allow_reuse=True)(show_command)
+
+    @validator("template")
+    def known_template(cls, name):
+        if name is not None and name not in templates:
+            raise ValueError(f"unknown template, upload it to /templates/{name} first")
+        return name
+
+def device_error(exc):
+    if isinstance(exc, scrapli.exceptions.ScrapliAuthenticationFailed):
+        return 'Timed out connecting to host, does it exist?'
+    return f"{type(exc).__name__}: {exc}"
+
+async def bulk_results(bulk: BulkCommand):
+    """Yield one result per host as soon as its command completes."""
+    fetch_host = lambda host: fetch(host, bulk.command, template=templates.get(bulk.template))
+
+    async for host, entry, exc in fan_out(bulk.targets(), fetch_host, bulk.concurrency):
+        if exc is None:
+            yield {"host": host, "detail": entry.value}
+        else:
+            yield {"host": host, "error": device_error(exc)}
+
+async def collect_bulk(bulk: BulkCommand):
+    detail, errors = {}, {}
+    async for result in bulk_results(bulk):
+        if "error" in result:
+            errors[result["host"]] = result["error"]
+        else:
+            detail[result["host"]] = result["detail"]
+
+    return {
+        "message": "Command executed sucessfully",
+        "detail": detail,
+        "errors": errors
+    }
+
+@app.post("/bulk/command/")
+async def bulk_command(bulk: BulkCommand):
+    """Run one show command across many devices, returning per-device results and errors."""
+    return ORJSONResponse(await collect_bulk(bulk))
+
+@app.post("/bulk/command/stream/")
+async def bulk_command_stream(bulk: BulkCommand):
+    """Same as /bulk/command/ but streams an NDJSON line per device the moment it completes."""
+    async def lines():
+        async for result in bulk_results(bulk):
+            yield orjson.dumps(result, option=orjson.OPT_NON_STR_KEYS) + b"\n"
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+
+jobs = JobManager(describe_error=device_error)
+
+def job_response(job):
+    return {
+        "message": f"Job {job.status}",
+        "detail": job.as_dict()
+    }
+
+def find_job(job_id):
+    job = jobs.get(job_id)
+    if job is None:
+        raise HTTPException(
+            status_code=404,
+            detail='Job not found, it may have expired'
+        )
+    return job
+
+@app.post("/jobs/bulk/command/", status_code=202)
+async def submit_bulk_command(bulk: BulkCommand, timeout: float | None = None):
+    """Same as /bulk/command/ but run as a job, returns the job to poll straight away."""
+    return job_response(jobs.submit("bulk command", lambda: collect_bulk(bulk), timeout))
+
+class BulkInterfaces(BulkTargets):
+    interfaces: list[Interface]
+    stop_on_failure: bool = False
+    concurrency: int = Field(BULK_CONCURRENCY, ge=1, le=BULK_MAX_CONCURRENCY)
+
+@app.post("/jobs/bulk/interfaces/", status_code=202)
+async def submit_bulk_interfaces(bulk: BulkInterfaces, timeout: float | None = None):
+    """Push the same interface config to many devices as a job, results are per host."""
+    async def push():
+        detail, errors = {}, {}
+        push_host = lambda host: push_interfaces(host, bulk.interfaces, bulk.stop_on_failure)
+        async for host, results, exc in fan_out(bulk.targets(), push_host, bulk.concurrency):
+            if exc is None:
+                detail[host] = results
+            else:
+                errors[host] = device_error(exc)
+        return {"detail": detail, "errors": errors}
+
+    return job_response(jobs.submit("bulk interfaces", push, timeout))
+
+class Interactive(BaseModel):
+    # (input, expected prompt, hide input) as taken by scrapli's send_interactive
+    events: list[tuple[str, str, bool]] = Field(..., min_items=1)
+
+    @validator("events")
+    def copy_commands_only(cls, events):
+        # Every input goes to the device as typed, so none may carry a second command on a new line
+        for channel_input, _, _ in events:
+            single_line(channel_input)
+        if not normalize_command(events[0][0]).lower().startswith("copy "):
+            raise ValueError("only copy commands can be run interactively")
+        return events
+
+@app.post("/{device_ip}/jobs/interactive/", status_code=202)
+async def submit_interactive(device_ip, interactive: Interactive, timeout: float | None = None):
+    """Run an interactive file copy (e.g. copy flash: scp:) as a job."""
+    send = lambda: async_send_command(device_ip, interactive.events, interactive=True)
+    return job_response(jobs.submit(f"interactive {interactive.events[0][0]}", send, timeout))
+
+@app.get("/jobs/{job_id}")
+async def show_job(job_id, wait: float = 0):
+    """Poll a job, optionally waiting up to `wait` seconds for it to finish first."""
+    job = find_job(job_id)
+    if wait > 0:
+        await jobs.wait(job, wait)
+    return job_response(job)
+
+@app.get("/jobs/{job_id}/stream/")
+async def stream_job(job_id):
+    """NDJSON line for every status change of a job, ending when it finishes."""
+    job = find_job(job_id)
+
+    async def lines():
+        async for update in jobs.watch(job):
+            yield orjson.dumps(update.as_dict(), option=orjson.OPT_NON_STR_KEYS) + b"\n"
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+@app.delete("/jobs/{job_id}")
+async def cancel_job(job_id):
+    return job_response(jobs.cancel(job_id) or find_job(job_id))
+
+
+@app.get("/templates/")
+async def list_templates():
+    """Registered TTP templates and their digests, usable by name as `template` in bulk requests."""
+    return {
+        "message": "Templates",
+        "detail": {name: template.digest for name, template in templates.templates.items()}
+    }
+
+def uploads_enabled():
+    if not TTP_TEMPLATE_UPLOADS:
+        raise HTTPException(
+            status_code=403,
+            detail='Template uploads are disabled, set TTP_TEMPLATE_UPLOADS to allow them'
+        )
+
+@app.put("/templates/{name}", status_code=201, dependencies=[Depends(uploads_enabled)])
+async def upload_template(name, request: Request):
+    """Register a TTP template (sent as the raw request body) under a name, replacing any existing one.
+
+    Only plain templates are taken, nothing that makes TTP run code or touch files.
+    """
+    try:
+        text = (await request.body()).decode()
+    except UnicodeDecodeError:
+        raise HTTPException(
+            status_code=400,
+            detail='Template is not UTF-8 text'
+        )
+    if not text.strip():
+        raise HTTPException(
+            status_code=400,
+            detail='Template is empty'
+        )
+
+    try:
+        check_upload(text)
+        template = templates.add(name, text)
+    except ValueError as exc:
+        raise HTTPException(
+            status_code=400,
+            detail=str(exc)
+        )
+    return {
+        "message": "Template uploaded sucessfully",
+        "detail": {"name": template.name, "digest": template.digest}
+    }
+
+@app.delete("/templates/{name}", dependencies=[Depends(uploads_enabled)])
+async def delete_template(name):
+    if templates.remove(name) is None:
+        raise HTTPException(
+            status_code=404,
+            detail='Template not found'
+        )
+    return {
+        "message": "Template deleted sucessfully"
+    }
+
+
+@app.post("/parse/")
+async def offline_parse(request: Request, concurrency: int = Query(OFFLINE_PARSE_CONCURRENCY, ge=1, le=BULK_MAX_CONCURRENCY)):
+    """Parse previously collected output without touching any device.
+
+    The body is JSONL records of {"command", "output", "platform", "id", "template"}, or a tar archive
+    (Content-Type application/x-tar or application/gzip) of .jsonl files. Results stream back as NDJSON.
+    """
+    content_type = request.headers.get("content-type", "")
+    archive = "tar" in content_type or "gzip" in content_type
+    try:
+        body = await spool(request.stream(), OFFLINE_PARSE_MAX_BODY)
+    except BodyTooLarge as exc:
+        raise HTTPException(
+            status_code=413,
+            detail=str(exc)
+        )
+
+    async def lines():
+        with body:
+            async for result in parse_records(read_records(body, archive), templates, concurrency):
+                yield orjson.dumps(result, option=orjson.OPT_NON_STR_KEYS) + b"\n"
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
 
 
+@app.delete("/cache/")
+async def invalidate_cache(device_ip=None, command=None):
+    """Drop cached output, optionally only for one device and/or command."""
+    host = None if device_ip is None else device_host(device_ip)
 
+    def match(key):
+        return (host is None or key[0] == host) and \
+            (command is None or key[1] == normalize_command(command))
 
-# Possible future cache implementation
-
-# def supported_command(command, check=False):
-#     """Supported commands ensure that a relevant parser exists for the output"""
-#     supported_commands = set([
-#         "show vlan",
-#         "show ip int brief"
-#         ]
-#     )
-#     if check:
-#         return supported_commands
-    
-#     return command in supported_commands
-
-
-# @app.get("/supported-commands/")
-# async def check_supported_show_commands():
-#     return supported_command("", True)
-
-# class SupportedShowCommands(str, Enum):
-#     show_vlan = "show vlan",
-#     show_ip_int_brief = "show ip interface brief",
-
-# @app.get("/{device_ip}/{command}")
-# async def send_show_command_to_device(device_ip, command: SupportedShowCommands):
-#     if not supported_command(command):
-#         raise HTTPException(status_code=400, detail=f"Command failed, command not supported {command}")
-#     return {    
-#         "message": "Command executed sucessfully",
-#         "detail": cache.retrieve_from_cache(command, device_ip)
-            
-#     }
-
-# class Cache():
-#     def __init__(self, cache={}):
-#         self.cache = cache
-
-#     def clear(self):
-#         self.cache = {}
-
-#     def update(self, device_ip, command):
-#         self.cache[device_ip] = send_command(device_ip, command, username=os.getenv("USERNAME"), password=os.getenv("PASSWORD"))
-
-#     def retrieve_from_cache(self, device_ip, command):
-#         if not device_ip in self.cache:
-#             try:
-#                 self.cache[device_ip] = {}
-#                 self.update(device_ip, command)
-#                 return self.cache[device_ip][command]
-#             except scrapli.exceptions.ScrapliAuthenticationFailed:
-#                 raise HTTPException(
-#                     status_code=404,
-#                     detail='Timed out connecting to host, does it exist?'
-#                 )
-#         elif not self.cache[device_ip].get(command):
-#             try:
-#                 self.update(device_ip, command)
-#                 return self.cache[device_ip][command]
-#             except scrapli.exceptions.ScrapliAuthenticationFailed:
-#                 raise HTTPException(
-#                     status_code=404,
-#                     detail='Timed out connecting to host, does it exist?'
-#                 )
-#         else:
-#             return self.cache[device_ip][command]
-
-
-# cache = Cache()
+    return {
+        "message": "Cache invalidated",
+        "detail": {"invalidated": cache.invalidate(match)}
+    }
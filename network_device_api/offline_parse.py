@@ -0,0 +1,149 @@
+"""Parse collected show output without touching any device.
+
+Records are JSON objects, one per line: {"command": ..., "output": ..., "platform": "iosxe"} with an
+optional "id" echoed back and "template" naming a TTP template. Results are NDJSON, one
+{"index": ..., "detail": ...} or {"index": ..., "error": ...} line per record as soon as it is parsed.
+
+    python -m network_device_api.offline_parse collected.jsonl > parsed.jsonl
+    python -m network_device_api.offline_parse archive.tar.gz --workers 8 > parsed.jsonl
+"""
+from .bulk import fan_out
+from .inventory import PLATFORMS
+from .templates import TTP_TEMPLATE_DIR, TemplateRegistry
+from . import parsing
+import argparse, asyncio, orjson, os, sys, tarfile, tempfile
+
+OFFLINE_PARSE_CONCURRENCY = int(os.getenv("OFFLINE_PARSE_CONCURRENCY", "32"))
+# Largest body POST /parse/ takes, in bytes, anything bigger is refused part way through the upload
+OFFLINE_PARSE_MAX_BODY = int(os.getenv("OFFLINE_PARSE_MAX_BODY", str(256 * 1024 * 1024)))
+# Bodies are held in memory up to this size, then moved to a temporary file on disk
+SPOOL_SIZE = 16 * 1024 * 1024
+GENIE_PLATFORMS = sorted({platform.genie_platform for platform in PLATFORMS.values()})
+
+
+class BodyTooLarge(Exception):
+    def __init__(self, max_size):
+        super().__init__(f"Body is larger than {max_size} bytes")
+        self.max_size = max_size
+
+
+def decode(line):
+    record = orjson.loads(line)
+    if not isinstance(record, dict) or not isinstance(record.get("command"), str) or not isinstance(record.get("output"), str):
+        raise ValueError("record needs command and output strings")
+    return record
+
+
+async def spool(chunks, max_size=OFFLINE_PARSE_MAX_BODY):
+    """Copy a request body into a file, in memory while it is small and on disk after that.
+
+    The body has to be read in full before responding, as a streaming response listens on the same
+    channel for the client going away. Raises BodyTooLarge as soon as it grows past max_size.
+    """
+    body = tempfile.SpooledTemporaryFile(max_size=SPOOL_SIZE)
+    size = 0
+    async for chunk in chunks:
+        size += len(chunk)
+        if size > max_size:
+            body.close()
+            raise BodyTooLarge(max_size)
+        body.write(chunk)
+    body.seek(0)
+    return body
+
+
+def tar_lines(source):
+    """Lines of every .jsonl member of a (optionally compressed) tar archive, read as a stream."""
+    with tarfile.open(fileobj=source, mode="r|*") as archive:
+        for member in archive:
+            if member.isfile() and member.name.endswith(".jsonl"):
+                yield from archive.extractfile(member)
+
+
+def read_records(source, archive=False):
+    """Yield (index, record) per line of a binary file, with the error in place of a record that can't be read."""
+    index = 0
+    try:
+        for line in (tar_lines(source) if archive else source):
+            if not line.strip():
+                continue
+            try:
+                record = decode(line)
+            except ValueError as exc:
+                record = exc
+            yield index, record
+            index += 1
+    except tarfile.TarError as exc:
+        yield index, ValueError(f"invalid archive: {exc}")
+
+
+async def parse_record(item, templates=None):
+    _, record = item
+    if isinstance(record, Exception):
+        raise record
+
+    template = None
+    if record.get("template"):
+        template = templates.get(record["template"]) if templates is not None else None
+        if template is None:
+            raise ValueError(f"unknown template {record['template']}")
+
+    platform = record.get("platform") or "iosxe"
+    if platform not in GENIE_PLATFORMS:
+        raise ValueError(f"unknown platform {platform}, expected one of {', '.join(GENIE_PLATFORMS)}")
+    result = await parsing.async_parse_output(record["output"], record["command"],
+                                              template.text if template else None, genie_platform=platform)
+    if isinstance(result, str):
+        raise ValueError(f"no parser for {record['command']} on {platform}")
+    return result
+
+
+async def parse_records(records, templates=None, concurrency=OFFLINE_PARSE_CONCURRENCY):
+    """Parse records from read_records on the parse workers, yielding a result per record as it completes."""
+    parse = lambda item: parse_record(item, templates)
+    async for (index, record), result, exc in fan_out(records, parse, concurrency):
+        line = {"index": index}
+        if isinstance(record, dict) and "id" in record:
+            line["id"] = record["id"]
+        if exc is None:
+            line["detail"] = result
+        else:
+            line["error"] = f"{type(exc).__name__}: {exc}"
+        yield line
+
+
+async def run(source, out, archive=False, templates=None, concurrency=OFFLINE_PARSE_CONCURRENCY):
+    errors = 0
+    async for line in parse_records(read_records(source, archive), templates, concurrency):
+        errors += "error" in line
+        out.write(orjson.dumps(line, option=orjson.OPT_NON_STR_KEYS) + b"\n")
+    return errors
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Parse collected show output offline, writing NDJSON results to stdout.")
+    parser.add_argument("source", help="JSONL file or tar archive of .jsonl files, - for JSONL on stdin")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="parse worker processes")
+    parser.add_argument("--concurrency", type=int, default=OFFLINE_PARSE_CONCURRENCY, help="records parsed at once")
+    parser.add_argument("--templates", default=TTP_TEMPLATE_DIR, help="directory of .ttp templates")
+    args = parser.parse_args(argv)
+
+    parsing.PARSE_WORKERS = args.workers
+    templates = TemplateRegistry(args.templates)
+    try:
+        if args.source == "-":
+            errors = asyncio.run(run(sys.stdin.buffer, sys.stdout.buffer, False, templates, args.concurrency))
+        else:
+            with open(args.source, "rb") as source:
+                archive = tarfile.is_tarfile(source)
+                source.seek(0)
+                errors = asyncio.run(run(source, sys.stdout.buffer, archive, templates, args.concurrency))
+    finally:
+        parsing.shutdown()
+
+    # Exit status 1 if any record failed, the details are in the output
+    return 1 if errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,58 @@
+from itertools import islice
+import os
+
+PAGE_SIZE = int(os.getenv("PAGE_SIZE", "100"))
+
+
+def collection_path(value):
+    """Keys leading from the top of a parsed output to the collection to page over.
+
+    Single key wrappers around a collection of entries, like {"vlans": {"1": {...}, ...}}, are
+    descended into, otherwise the top level keys (e.g. interface names) are the collection.
+    """
+    path = []
+    while isinstance(value, dict) and len(value) == 1:
+        (key, child), = value.items()
+        if not isinstance(child, dict) or not child or not all(isinstance(entry, dict) for entry in child.values()):
+            break
+        path.append(key)
+        value = child
+    return path
+
+
+def paginate(value, offset, limit):
+    """Return (page, next offset or None, total entries) with the page rewrapped like the original."""
+    path = collection_path(value)
+    collection = value
+    for key in path:
+        collection = collection[key]
+    if not isinstance(collection, dict):
+        return value, None, 1
+
+    page = dict(islice(collection.items(), offset, offset + limit))
+    next_offset = offset + limit if offset + limit < len(collection) else None
+    for key in reversed(path):
+        page = {key: page}
+    return page, next_offset, len(collection)
+
+
+class Page():
+    """`limit` and `cursor` query parameters. A cursor is `version:offset`, pinning every page after
+    the first to the same snapshot of the output."""
+
+    def __init__(self, limit=None, cursor=None):
+        self.limit = limit or PAGE_SIZE
+        self.requested = limit is not None or cursor is not None
+        self.version, self.offset = None, 0
+        if cursor:
+            version, _, offset = cursor.rpartition(":")
+            if not version or not offset.isdigit():
+                raise ValueError(f"Invalid cursor '{cursor}'")
+            self.version, self.offset = version, int(offset)
+
+    def __bool__(self):
+        return self.requested
+
+    @staticmethod
+    def cursor(version, offset):
+        return None if offset is None else f"{version}:{offset}"
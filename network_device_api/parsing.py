@@ -0,0 +1,219 @@
+from concurrent.futures import ProcessPoolExecutor
+from .cache import Cache
+from .templates import template_digest, ttp_parse
+import asyncio, functools, hashlib, logging, multiprocessing, os, re, threading
+
+# 0 parses on the event loop's default thread pool, anything higher uses that many worker processes
+PARSE_WORKERS = int(os.getenv("PARSE_WORKERS", "0"))
+# Load Genie and the parsers for the API's commands at startup instead of on the first request
+PARSE_PREWARM = os.getenv("PARSE_PREWARM", "false").lower() in ("1", "true", "yes")
+
+logger = logging.getLogger(__name__)
+
+# Commands the API sends, as a pattern over the command and an example used to resolve its Genie parser.
+# Named groups are handed to the parser as arguments so must match Genie's own argument names.
+SUPPORTED_COMMANDS = [
+    (r"show vlan", "show vlan"),
+    (r"show vlan id (?P<vlan_id>\S+)", "show vlan id 1"),
+    (r"show ip interface brief", "show ip interface brief"),
+    (r"show interfaces", "show interfaces"),
+    # Interface names end in a number, so subcommands like `show interfaces status` aren't taken for one
+    (r"show interfaces? (?P<interface>[A-Za-z][A-Za-z-]*\s?\d\S*)", "show interfaces GigabitEthernet1"),
+    (r"show run(?:ning-config)? interface (?P<interface>\S+)", "show running-config interface GigabitEthernet1"),
+]
+PARSER_LOOKUP_CACHE = int(os.getenv("PARSER_LOOKUP_CACHE", "1024"))
+# Parsed results kept per process, keyed by a hash of the raw output they were parsed from
+PARSE_MEMO_SIZE = int(os.getenv("PARSE_MEMO_SIZE", "4096"))
+
+_executor = None
+_prewarm_args = ()
+_memo = Cache(maxsize=PARSE_MEMO_SIZE, default_ttl=None)
+_memo_lock = threading.Lock()
+
+
+def _genie():
+    """Import Genie on first use, returns (Device, get_parser) or None when it isn't installed."""
+    try:
+        from genie.conf.base import Device
+        from genie.libs.parser.utils import get_parser
+    except ModuleNotFoundError:
+        return None
+    return Device, get_parser
+
+
+# Bounded though platforms are checked before getting here, one entry per platform is all they hold
+@functools.lru_cache(maxsize=16)
+def _genie_device(genie_platform):
+    Device, _ = _genie()
+    return Device("scrapli_device", custom={"abstraction": {"order": ["os"]}}, os=genie_platform)
+
+
+@functools.lru_cache(maxsize=16)
+def parser_registry(genie_platform="iosxe"):
+    """Resolve the Genie parser class of every supported command once per process."""
+    genie = _genie()
+    if genie is None:
+        logger.warning("genie is not installed, output will not be parsed")
+        return ()
+
+    _, get_parser = genie
+    registry = []
+    for pattern, example in SUPPORTED_COMMANDS:
+        try:
+            parser_class, _ = get_parser(example, _genie_device(genie_platform))
+        except Exception:
+            logger.info(f"no genie parser for {example} on {genie_platform}")
+            continue
+        registry.append((re.compile(pattern, re.IGNORECASE), parser_class))
+    return tuple(registry)
+
+
+@functools.lru_cache(maxsize=PARSER_LOOKUP_CACHE)
+def find_parser(command, genie_platform="iosxe"):
+    """Return (parser_class, kwargs) for a command, or None if Genie has no parser for it.
+
+    Supported commands go straight to their precomputed parser. Anything else pays for Genie's fuzzy
+    lookup once, after which the answer (including 'no parser') is remembered.
+    """
+    command = " ".join(command.split())
+    for pattern, parser_class in parser_registry(genie_platform):
+        match = pattern.fullmatch(command)
+        if match:
+            return parser_class, match.groupdict()
+
+    genie = _genie()
+    if genie is None:
+        return None
+    try:
+        return genie[1](command, _genie_device(genie_platform))
+    except Exception:
+        return None
+
+
+def memo_key(output, command, template=None, genie_platform="iosxe"):
+    """Identical raw output for the same command, template and platform always parses the same."""
+    return (genie_platform, " ".join(command.split()), template_digest(template) if template else None,
+            hashlib.blake2b(output.encode(), digest_size=16).hexdigest())
+
+
+def memo_get(key):
+    with _memo_lock:
+        entry = _memo.get(key)
+    return None if entry is None else entry.value
+
+
+def memo_set(key, result):
+    # Unparsed output costs nothing to produce again, so isn't worth the memory. Checked by type, a
+    # string back from a parse worker is a copy rather than the output itself
+    if not isinstance(result, str):
+        with _memo_lock:
+            _memo.set(key, result)
+
+
+def clear_memo():
+    with _memo_lock:
+        _memo.clear()
+
+
+def parse_output(output, command, template=None, genie_platform="iosxe", textfsm_platform="cisco_iosxe"):
+    """Structure raw command output with TTP if a template is given, else Genie, else return it as is.
+
+    Output byte for byte identical to something already parsed (the same show vlan from a fleet of
+    identical switches, or an unchanged device polled again) is answered from a memo. Results are
+    shared between callers, so must not be modified.
+    """
+    key = memo_key(output, command, template, genie_platform)
+    result = memo_get(key)
+    if result is None:
+        result = _parse_output(output, command, template, genie_platform, textfsm_platform)
+        memo_set(key, result)
+    return result
+
+
+def _parse_output(output, command, template=None, genie_platform="iosxe", textfsm_platform="cisco_iosxe"):
+    """Only takes plain strings so it can be shipped off to a worker process, which compiles each template
+    the first time it sees it.
+    """
+    if template:
+        return ttp_parse(template, output)
+
+    parser = find_parser(command, genie_platform)
+    if parser is None:
+        return output
+
+    parser_class, kwargs = parser
+    try:
+        structured_result = parser_class(device=_genie_device(genie_platform)).parse(output=output, **kwargs)
+    except Exception as exc:
+        logger.warning(f"failed to parse data with genie, genie raised exception: `{exc}`")
+        return output
+
+    return structured_result or output
+
+
+def prewarm(commands, genie_platforms=("iosxe",)):
+    """Import Genie and resolve the parser for each command on each platform, returning the commands
+    that have one on any of them.
+
+    Genie is only ever imported on first use, never at module import time, so importing the API stays
+    cheap and this is the one place the cost is paid up front.
+    """
+    found = dict.fromkeys(commands, False)
+    for genie_platform in genie_platforms:
+        for command in commands:
+            found[command] |= find_parser(command, genie_platform) is not None
+    return [command for command, parsed in found.items() if parsed]
+
+
+def _worker_ready():
+    return os.getpid()
+
+
+def get_executor():
+    global _executor
+    if _executor is None and PARSE_WORKERS > 0:
+        # Workers started after a prewarm load the same parsers before taking any work. They come from
+        # a forkserver rather than a fork of this process, whose other threads (transports, the default
+        # executor) may hold a lock at that moment and leave it locked forever in the child
+        _executor = ProcessPoolExecutor(
+            max_workers=PARSE_WORKERS,
+            mp_context=multiprocessing.get_context("forkserver"),
+            initializer=prewarm if _prewarm_args else None,
+            initargs=_prewarm_args)
+    return _executor
+
+
+async def async_prewarm(commands, genie_platforms=("iosxe",)):
+    """Prewarm parsers in this process and start every parse worker so none of them is cold."""
+    global _prewarm_args
+    _prewarm_args = (tuple(commands), tuple(genie_platforms))
+    loop = asyncio.get_running_loop()
+    loaded = await loop.run_in_executor(None, prewarm, *_prewarm_args)
+
+    executor = get_executor()
+    if executor is not None:
+        await asyncio.gather(*[loop.run_in_executor(executor, _worker_ready) for _ in range(PARSE_WORKERS)])
+    return loaded
+
+
+async def async_parse_output(output, command, template=None, genie_platform="iosxe", textfsm_platform="cisco_iosxe"):
+    """Run parse_output off the event loop so large outputs don't stall other requests.
+
+    The memo is checked here first, so output that has been parsed before never goes to a worker.
+    """
+    key = memo_key(output, command, template, genie_platform)
+    result = memo_get(key)
+    if result is None:
+        loop = asyncio.get_running_loop()
+        result = await loop.run_in_executor(
+            get_executor(),
+            functools.partial(_parse_output, output, command, template, genie_platform, textfsm_platform))
+        memo_set(key, result)
+    return result
+
+
+def shutdown():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(cancel_futures=True)
+        _executor = None
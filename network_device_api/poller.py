@@ -0,0 +1,82 @@
+from .bulk import fan_out
+from .inventory import inventory
+import asyncio, logging, os, random, time
+
+POLL_DEVICES = [device.strip() for device in os.getenv("POLL_DEVICES", "").split(",") if device.strip()]
+# Inventory devices carrying all of these tags are polled as well
+POLL_TAGS = [tag.strip() for tag in os.getenv("POLL_TAGS", "").split(",") if tag.strip()]
+POLL_COMMANDS = [command.strip() for command in os.getenv("POLL_COMMANDS", "show vlan;show ip interface brief").split(";") if command.strip()]
+POLL_INTERVAL = float(os.getenv("POLL_INTERVAL", "30"))
+# Fraction of the interval each round is randomly shifted by, so replicas don't poll in lockstep
+POLL_JITTER = float(os.getenv("POLL_JITTER", "0.1"))
+POLL_CONCURRENCY = int(os.getenv("POLL_CONCURRENCY", "10"))
+
+logger = logging.getLogger(__name__)
+
+
+class Poller():
+    """Re-runs a set of commands on a set of devices every interval to keep their cached output warm.
+
+    `refresh(device, commands)` does the work for one device, so all of its commands share a session.
+    """
+
+    def __init__(self, refresh, devices=POLL_DEVICES, commands=POLL_COMMANDS, interval=POLL_INTERVAL,
+                 jitter=POLL_JITTER, concurrency=POLL_CONCURRENCY, tags=POLL_TAGS):
+        self.refresh = refresh
+        self.devices = list(dict.fromkeys(list(devices) + inventory.tagged(tags)))
+        self.commands = list(commands)
+        self.interval = interval
+        self.jitter = jitter
+        self.concurrency = concurrency
+        self.rounds = 0
+        self.last_round = None
+        self.errors = {}
+        self._task = None
+
+    def _jittered(self, delay):
+        spread = self.interval * self.jitter
+        return max(delay + random.uniform(-spread, spread), 0)
+
+    async def poll_once(self):
+        """Refresh every device once, returning how many failed."""
+        started = time.monotonic()
+        refresh = lambda device: self.refresh(device, self.commands)
+        async for device, _, exc in fan_out(self.devices, refresh, self.concurrency):
+            if exc is None:
+                self.errors.pop(device, None)
+            else:
+                self.errors[device] = f"{type(exc).__name__}: {exc}"
+                logger.warning(f"polling {device} failed: {exc}")
+
+        self.rounds += 1
+        self.last_round = {"finished_at": time.time(), "seconds": time.monotonic() - started}
+        return len(self.errors)
+
+    async def run(self):
+        await asyncio.sleep(self._jittered(0))
+        while True:
+            started = time.monotonic()
+            await self.poll_once()
+            await asyncio.sleep(self._jittered(self.interval - (time.monotonic() - started)))
+
+    def start(self):
+        if self.devices and self.commands and self._task is None:
+            self._task = asyncio.ensure_future(self.run())
+        return self._task
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def status(self):
+        return {
+            "running": self._task is not None,
+            "devices": self.devices,
+            "commands": self.commands,
+            "interval": self.interval,
+            "rounds": self.rounds,
+            "last_round": self.last_round,
+            "errors": self.errors,
+        }
@@ -0,0 +1,196 @@
+from contextlib import asynccontextmanager
+from scrapli.exceptions import ScrapliConnectionError, ScrapliConnectionNotOpened
+import asyncio, math, os, time
+
+POOL_MAX_SESSIONS = int(os.getenv("POOL_MAX_SESSIONS", "2"))
+POOL_IDLE_TTL = float(os.getenv("POOL_IDLE_TTL", "300"))
+POOL_QUEUE_DEPTH = int(os.getenv("POOL_QUEUE_DEPTH", "20"))
+POOL_QUEUE_TIMEOUT = float(os.getenv("POOL_QUEUE_TIMEOUT", "30"))
+
+# Raised when the device has dropped the VTY line under us, as opposed to rejecting the command
+DROPPED_CONNECTION_ERRORS = (ScrapliConnectionNotOpened, ScrapliConnectionError, ConnectionError)
+
+
+class DeviceBusy(Exception):
+    """A device has no free session and its queue is full (queue_full) or the wait for one timed out."""
+
+    def __init__(self, host, retry_after, queue_full=True):
+        reason = "too many requests queued" if queue_full else "timed out waiting for a session"
+        super().__init__(f"Device {host} is busy, {reason}")
+        self.host = host
+        self.retry_after = retry_after
+        self.queue_full = queue_full
+
+
+class DeviceLimiter():
+    """Caps concurrent sessions to one device and how many requests may queue up waiting for one."""
+
+    def __init__(self, host, max_sessions=POOL_MAX_SESSIONS, queue_depth=POOL_QUEUE_DEPTH, queue_timeout=POOL_QUEUE_TIMEOUT):
+        self.host = host
+        self.max_sessions = max_sessions
+        self.queue_depth = queue_depth
+        self.queue_timeout = queue_timeout
+        self.waiting = 0
+        # Moving average of how long a session is held, used to estimate Retry-After
+        self.hold_time = 1.0
+        self._semaphore = asyncio.Semaphore(max_sessions)
+
+    def retry_after(self):
+        return max(1, math.ceil(self.hold_time * (self.waiting + 1) / self.max_sessions))
+
+    @asynccontextmanager
+    async def slot(self):
+        if self._semaphore.locked():
+            if self.waiting >= self.queue_depth:
+                raise DeviceBusy(self.host, self.retry_after(), queue_full=True)
+
+            self.waiting += 1
+            try:
+                await asyncio.wait_for(self._semaphore.acquire(), self.queue_timeout)
+            except asyncio.TimeoutError:
+                raise DeviceBusy(self.host, self.retry_after(), queue_full=False) from None
+            finally:
+                self.waiting -= 1
+        else:
+            await self._semaphore.acquire()
+
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.hold_time = 0.8 * self.hold_time + 0.2 * (time.monotonic() - started)
+            self._semaphore.release()
+
+
+class ConnectionPool():
+    """Keeps authenticated sessions open per (host, username) so requests skip the SSH/auth/priv setup."""
+
+    def __init__(self, max_sessions=POOL_MAX_SESSIONS, idle_ttl=POOL_IDLE_TTL,
+                 queue_depth=POOL_QUEUE_DEPTH, queue_timeout=POOL_QUEUE_TIMEOUT):
+        self.max_sessions = max_sessions
+        self.idle_ttl = idle_ttl
+        self.queue_depth = queue_depth
+        self.queue_timeout = queue_timeout
+        self._idle = {}
+        self._limits = {}
+
+    def _limit(self, host, max_sessions=None):
+        if host not in self._limits:
+            self._limits[host] = DeviceLimiter(host, max_sessions or self.max_sessions, self.queue_depth, self.queue_timeout)
+        return self._limits[host]
+
+    def _expired(self, last_used):
+        return time.monotonic() - last_used >= self.idle_ttl
+
+    async def _open(self, settings, driver):
+        conn = driver(**settings)
+        await conn.open()
+        return conn
+
+    async def _close(self, conn):
+        try:
+            await conn.close()
+        except Exception:
+            # The session is being thrown away, it may well be dead already
+            pass
+
+    async def _checkout(self, key, settings, driver):
+        """Return (conn, reused), preferring the most recently used live session."""
+        idle = self._idle.get(key, [])
+        while idle:
+            conn, last_used = idle.pop()
+            if not self._expired(last_used) and conn.isalive():
+                return conn, True
+            await self._close(conn)
+
+        return await self._open(settings, driver), False
+
+    def _checkin(self, key, conn):
+        self._idle.setdefault(key, []).append((conn, time.monotonic()))
+
+    async def run(self, settings, driver, operation, max_sessions=None):
+        """Run `await operation(conn)` on a pooled session.
+
+        A reused session that turns out to have been dropped by the device is replaced with a fresh
+        one and the operation retried once, so callers never see a stale VTY line. Raises DeviceBusy
+        rather than piling more sessions onto a device that is already saturated. max_sessions
+        overrides the pool's limit for this device (e.g. from the inventory).
+        """
+        key = (settings["host"], settings["auth_username"])
+
+        async with self._limit(settings["host"], max_sessions).slot():
+            conn, reused = await self._checkout(key, settings, driver)
+            try:
+                result = await operation(conn)
+            except DROPPED_CONNECTION_ERRORS:
+                await self._close(conn)
+                if not reused:
+                    raise
+                conn = await self._open(settings, driver)
+                try:
+                    result = await operation(conn)
+                except BaseException:
+                    await self._close(conn)
+                    raise
+            except BaseException:
+                await self._close(conn)
+                raise
+
+            self._checkin(key, conn)
+            return result
+
+    @asynccontextmanager
+    async def session(self, settings, driver, max_sessions=None):
+        """Hold a pooled session for as long as the caller needs it, e.g. to stream output from it.
+
+        Unlike run nothing is retried, and if the caller stops part way (an exception, or its generator
+        being closed when a client disconnects) the session is closed rather than reused, as the device
+        may still be sending output down it.
+        """
+        key = (settings["host"], settings["auth_username"])
+
+        async with self._limit(settings["host"], max_sessions).slot():
+            conn, _ = await self._checkout(key, settings, driver)
+            try:
+                yield conn
+            except BaseException:
+                await self._close(conn)
+                raise
+            self._checkin(key, conn)
+
+    async def evict_idle(self):
+        """Close sessions that have sat idle for longer than idle_ttl."""
+        # Pick them out without awaiting, a checkout running while we close must not be able to take
+        # a session that is about to be put back in the idle list
+        expired = []
+        for key, idle in list(self._idle.items()):
+            keep = []
+            for conn, last_used in idle:
+                if self._expired(last_used) or not conn.isalive():
+                    expired.append(conn)
+                else:
+                    keep.append((conn, last_used))
+            if keep:
+                self._idle[key] = keep
+            else:
+                del self._idle[key]
+
+        for conn in expired:
+            await self._close(conn)
+        return len(expired)
+
+    async def reap(self, interval=None):
+        """Background task evicting idle sessions every interval seconds."""
+        interval = interval or max(self.idle_ttl / 2, 1)
+        while True:
+            await asyncio.sleep(interval)
+            await self.evict_idle()
+
+    async def close(self):
+        for idle in self._idle.values():
+            for conn, _ in idle:
+                await self._close(conn)
+        self._idle = {}
+
+
+pool = ConnectionPool()
@@ -0,0 +1,124 @@
+from fnmatch import fnmatchcase
+import re
+
+WILDCARDS = re.compile(r"[*?\[]")
+CONDITION = re.compile(r"^(?P<path>[^!=]+)(?P<op>==|!=)(?P<value>.*)$")
+
+# Marks a branch with nothing left in it after projecting
+MISSING = object()
+
+
+def split_paths(paths):
+    """'*.oper_status,*.description' -> [['*', 'oper_status'], ['*', 'description']]"""
+    return [path.strip().split(".") for path in (paths or "").split(",") if path.strip()]
+
+
+def as_text(value):
+    """How a parsed value is compared with the text of a where condition, JSON style for bools and None."""
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if value is None:
+        return "null"
+    return str(value)
+
+
+def include_paths(value, paths):
+    """Keep only the parts of value under one of the paths, each segment is an fnmatch pattern."""
+    if any(not path for path in paths):
+        return value
+    if not isinstance(value, dict):
+        return MISSING
+
+    result = {}
+    for key, child in value.items():
+        rest = [path[1:] for path in paths if fnmatchcase(str(key), path[0])]
+        if rest and (child := include_paths(child, rest)) is not MISSING:
+            result[key] = child
+    return result or MISSING
+
+
+def exclude_paths(value, paths):
+    """Drop the parts of value under any of the paths."""
+    if any(not path for path in paths):
+        return MISSING
+    if not isinstance(value, dict):
+        return value
+
+    result = {}
+    for key, child in value.items():
+        rest = [path[1:] for path in paths if fnmatchcase(str(key), path[0])]
+        if not rest or (child := exclude_paths(child, rest)) is not MISSING:
+            result[key] = child
+    return result
+
+
+def lookup(value, path):
+    """Every value found at path, which may itself contain wildcards."""
+    if not path:
+        return [value]
+    if not isinstance(value, dict):
+        return []
+    return [found for key, child in value.items() if fnmatchcase(str(key), path[0])
+            for found in lookup(child, path[1:])]
+
+
+class Condition():
+    """One `path==value` or `path!=value` filter.
+
+    The first wildcard segment of the path picks the entries being filtered and the rest is looked up
+    inside each one, so `vlans.*.state==active` keeps active vlans. A path without a wildcard is taken
+    to be relative to the top level entries, e.g. `oper_status==down` for show interfaces.
+    """
+
+    def __init__(self, text):
+        match = CONDITION.match(text.strip())
+        if match is None:
+            raise ValueError(f"Invalid where condition '{text}', expected path==value or path!=value")
+
+        self.path = match["path"].strip().split(".")
+        if not any(WILDCARDS.search(segment) for segment in self.path):
+            self.path = ["*"] + self.path
+        self.position = next(index for index, segment in enumerate(self.path) if WILDCARDS.search(segment))
+        self.equal = match["op"] == "=="
+        self.value = match["value"].strip()
+
+    def matches(self, entry):
+        found = any(as_text(value) == self.value for value in lookup(entry, self.path[self.position + 1:]))
+        return found if self.equal else not found
+
+    def apply(self, value, depth=0):
+        if not isinstance(value, dict):
+            return value
+        if depth < self.position:
+            key = self.path[depth]
+            if key not in value:
+                return value
+            return {**value, key: self.apply(value[key], depth + 1)}
+
+        return {key: entry for key, entry in value.items()
+                if fnmatchcase(str(key), self.path[depth]) and self.matches(entry)}
+
+
+class Projection():
+    """Server side `fields=`, `exclude=` and `where=` applied to parsed output, in that order: where,
+    fields then exclude. Paths are dot separated with fnmatch wildcards per segment, and several can be
+    given separated by commas (where conditions must all hold).
+    """
+
+    def __init__(self, fields=None, exclude=None, where=None):
+        self.fields = split_paths(fields)
+        self.exclude = split_paths(exclude)
+        self.where = [Condition(condition) for condition in (where or "").split(",") if condition.strip()]
+        self.key = (fields or "", exclude or "", where or "")
+
+    def __bool__(self):
+        return bool(self.fields or self.exclude or self.where)
+
+    def apply(self, value):
+        for condition in self.where:
+            value = condition.apply(value)
+        if self.fields:
+            value = include_paths(value, self.fields)
+        if self.exclude:
+            value = exclude_paths(value, self.exclude)
+        return {} if value is MISSING else value
@@ -0,0 +1,25 @@
+import asyncio
+
+
+class SingleFlight():
+    """Coalesces concurrent calls with the same key onto one in-flight task whose result they all share."""
+
+    def __init__(self):
+        self._calls = {}
+
+    def __len__(self):
+        return len(self._calls)
+
+    async def do(self, key, fn, *args, **kwargs):
+        task = self._calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn(*args, **kwargs))
+            self._calls[key] = task
+            task.add_done_callback(lambda done: self._forget(key, done))
+
+        # Shielded so one caller going away (client disconnect) doesn't cancel the call for everyone else
+        return await asyncio.shield(task)
+
+    def _forget(self, key, task):
+        if self._calls.get(key) is task:
+            del self._calls[key]
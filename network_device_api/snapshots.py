@@ -0,0 +1,64 @@
+from collections import OrderedDict
+from .cache import Cache
+import hashlib, orjson, os
+
+SNAPSHOT_MAXSIZE = int(os.getenv("SNAPSHOT_MAXSIZE", "1024"))
+SNAPSHOT_VERSIONS = int(os.getenv("SNAPSHOT_VERSIONS", "4"))
+
+
+def content_hash(value):
+    """Stable version of a parsed output, identical structures hash the same whatever their key order."""
+    serialized = orjson.dumps(value, option=orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS)
+    return hashlib.blake2b(serialized, digest_size=16).hexdigest()
+
+
+class SnapshotStore():
+    """Keeps the last few versions of each (device, command) result so clients can ask what changed."""
+
+    def __init__(self, maxsize=SNAPSHOT_MAXSIZE, versions=SNAPSHOT_VERSIONS):
+        self.versions = versions
+        self._snapshots = Cache(maxsize=maxsize, default_ttl=None)
+
+    def add(self, key, version, value):
+        entry = self._snapshots.get(key)
+        history = entry.value if entry else OrderedDict()
+        history[version] = value
+        history.move_to_end(version)
+        while len(history) > self.versions:
+            history.popitem(last=False)
+        if entry is None:
+            self._snapshots.set(key, history)
+
+    def get(self, key, version):
+        entry = self._snapshots.get(key)
+        if entry is None:
+            return None
+        return entry.value.get(version)
+
+    def clear(self):
+        self._snapshots.clear()
+
+
+def diff(old, new):
+    """Structural diff of two parsed outputs.
+
+    Returns the paths (lists of keys) that were added or changed along with their new value, and the
+    paths that were removed. Only dicts are descended into, anything else is compared as a whole.
+    """
+    changes = {"added": [], "removed": [], "changed": []}
+    _diff(old, new, [], changes)
+    return changes
+
+
+def _diff(old, new, path, changes):
+    if isinstance(old, dict) and isinstance(new, dict):
+        for key in old:
+            if key not in new:
+                changes["removed"].append({"path": path + [key]})
+        for key, value in new.items():
+            if key not in old:
+                changes["added"].append({"path": path + [key], "value": value})
+            else:
+                _diff(old[key], value, path + [key], changes)
+    elif old != new:
+        changes["changed"].append({"path": path, "value": new})
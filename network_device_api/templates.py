@@ -0,0 +1,148 @@
+from collections import OrderedDict
+from dataclasses import dataclass
+from pathlib import Path
+import hashlib, logging, os, re, threading
+
+# Directory of *.ttp files loaded at startup, each available under its file name without the extension
+TTP_TEMPLATE_DIR = os.getenv("TTP_TEMPLATE_DIR", "")
+# Compiled templates kept per process
+TTP_TEMPLATE_CACHE = int(os.getenv("TTP_TEMPLATE_CACHE", "128"))
+# PUT/DELETE /templates/ are refused unless this is set
+TTP_TEMPLATE_UPLOADS = os.getenv("TTP_TEMPLATE_UPLOADS", "false").lower() in ("1", "true", "yes")
+
+# The only tags an uploaded template may use. The rest can run Python (<macro>, <vars>) or read and
+# write files (<input>, <output>, <lookup>, <extend>), as can these attributes
+UPLOAD_TAGS = ("template", "group", "g", "doc")
+UPLOAD_ATTRIBUTES = re.compile(r"\b(input|load|include|url)\s*=", re.IGNORECASE)
+
+TEMPLATE_NAME = "network_device_api"
+
+logger = logging.getLogger(__name__)
+
+_compiled = OrderedDict()
+_compiled_lock = threading.Lock()
+
+
+def _ttp():
+    """Import TTP on first use, returns its ttp class or None when it isn't installed."""
+    try:
+        from ttp import ttp
+    except ModuleNotFoundError:
+        return None
+    return ttp
+
+
+def template_digest(text):
+    return hashlib.blake2b(text.encode(), digest_size=16).hexdigest()
+
+
+def check_upload(text):
+    """Raise ValueError if a template sent to the API uses anything that can run code or touch files."""
+    for tag, attributes in re.findall(r"<\s*([A-Za-z_][\w.-]*)([^>]*)>", text):
+        if tag.lower() not in UPLOAD_TAGS:
+            raise ValueError(f"<{tag}> isn't allowed in uploaded templates")
+        attribute = UPLOAD_ATTRIBUTES.search(attributes)
+        if attribute:
+            raise ValueError(f"{attribute.group(1)} isn't allowed in uploaded templates")
+
+
+class CompiledTemplate():
+    """A TTP parser with the template already loaded, so each parse only pays for the matching.
+
+    A TTP parser holds its input and results between calls, so one parse runs at a time per template.
+    """
+
+    def __init__(self, text, ttp):
+        self.parser = ttp()
+        self.parser.add_template(template=text, template_name=TEMPLATE_NAME)
+        self.lock = threading.Lock()
+
+    def parse(self, output):
+        with self.lock:
+            self.parser.clear_input()
+            self.parser.clear_result()
+            self.parser.add_input(data=output, template_name=TEMPLATE_NAME)
+            self.parser.parse(one=True)
+            return self.parser.result(structure="dictionary")[TEMPLATE_NAME]
+
+
+def compiled(text):
+    """The CompiledTemplate for a template's text, compiled once per process and cached by content hash."""
+    digest = template_digest(text)
+    with _compiled_lock:
+        if digest in _compiled:
+            _compiled.move_to_end(digest)
+            return _compiled[digest]
+
+    ttp = _ttp()
+    if ttp is None:
+        return None
+    template = CompiledTemplate(text, ttp)
+
+    with _compiled_lock:
+        _compiled[digest] = template
+        while len(_compiled) > TTP_TEMPLATE_CACHE:
+            _compiled.popitem(last=False)
+    return template
+
+
+def ttp_parse(text, output):
+    """Same as scrapli's ttp_parse_output but with a compiled template, [] if parsing fails."""
+    template = compiled(text)
+    if template is None:
+        logger.warning("ttp is not installed, output will not be parsed")
+        return []
+
+    try:
+        return template.parse(output) or []
+    except Exception as exc:
+        logger.warning(f"failed to parse data with ttp, ttp raised exception: `{exc}`")
+        return []
+
+
+def clear_compiled():
+    with _compiled_lock:
+        _compiled.clear()
+
+
+@dataclass(frozen=True)
+class Template():
+    name: str
+    text: str
+    digest: str
+
+
+class TemplateRegistry():
+    """TTP templates known by name, loaded from TTP_TEMPLATE_DIR or uploaded through the API."""
+
+    def __init__(self, directory=TTP_TEMPLATE_DIR):
+        self.templates = {}
+        if directory:
+            self.load(directory)
+
+    def __len__(self):
+        return len(self.templates)
+
+    def __contains__(self, name):
+        return name in self.templates
+
+    def load(self, directory):
+        for path in sorted(Path(directory).glob("*.ttp")):
+            self.add(path.stem, path.read_text())
+
+    def add(self, name, text):
+        """Register a template, raising ValueError if TTP can't load it."""
+        try:
+            compiled(text)
+        except Exception as exc:
+            raise ValueError(f"invalid template: {exc}") from None
+
+        template = Template(name, text, template_digest(text))
+        self.templates[name] = template
+        return template
+
+    def get(self, name):
+        return self.templates.get(name)
+
+    def remove(self, name):
+        return self.templates.pop(name, None)
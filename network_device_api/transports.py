@@ -0,0 +1,113 @@
+from concurrent.futures import ThreadPoolExecutor
+from scrapli.driver.core import IOSXEDriver
+import asyncio, functools, importlib.util, os
+
+# asyncssh runs on the event loop. system (an ssh process per session), paramiko and ssh2 block, so
+# the async code paths run them on TRANSPORT_THREADS threads
+SSH_TRANSPORT = os.getenv("SSH_TRANSPORT", "asyncssh")
+TRANSPORT_THREADS = int(os.getenv("TRANSPORT_THREADS", "64"))
+
+ASYNC_TRANSPORTS = ("asyncssh",)
+SYNC_TRANSPORTS = ("system", "paramiko", "ssh2")
+# Transports whose library only comes with the extra of the same name
+EXTRA_TRANSPORTS = ("paramiko", "ssh2")
+
+
+def check_transport(transport):
+    """Raise ValueError for a transport scrapli doesn't have, or whose library isn't installed."""
+    if transport not in ASYNC_TRANSPORTS + SYNC_TRANSPORTS:
+        raise ValueError(f"SSH_TRANSPORT must be one of {', '.join(ASYNC_TRANSPORTS + SYNC_TRANSPORTS)}, not {transport}")
+    if transport in EXTRA_TRANSPORTS and importlib.util.find_spec(transport) is None:
+        raise ValueError(f"the {transport} transport isn't installed, install network-device-api[{transport}]")
+
+
+check_transport(SSH_TRANSPORT)
+
+_executor = None
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=TRANSPORT_THREADS, thread_name_prefix="transport")
+    return _executor
+
+
+async def run_blocking(method, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_executor(), functools.partial(method, *args, **kwargs))
+
+
+class ThreadedChannel():
+    """Just enough of scrapli's AsyncChannel over a blocking channel to stream output from it."""
+
+    def __init__(self, channel):
+        self.channel = channel
+
+    def write(self, channel_input):
+        self.channel.write(channel_input)
+
+    def send_return(self):
+        self.channel.send_return()
+
+    async def read(self):
+        return await run_blocking(self.channel.read)
+
+
+class ThreadedDriver():
+    """Async face over a blocking scrapli driver (IOSXEDriver unless made by threaded()), so pooled
+    sessions can use any transport.
+
+    Every call runs on a transport thread. The pool already makes sure only one request uses a
+    session at a time, so the driver itself never sees concurrent calls.
+    """
+
+    driver_class = IOSXEDriver
+
+    def __init__(self, **settings):
+        self.conn = self.driver_class(**settings)
+        self.channel = ThreadedChannel(self.conn.channel)
+
+    def __getattr__(self, name):
+        # Settings such as comms_prompt_pattern and timeout_ops
+        return getattr(self.conn, name)
+
+    def isalive(self):
+        return self.conn.isalive()
+
+    async def open(self):
+        return await run_blocking(self.conn.open)
+
+    async def close(self):
+        return await run_blocking(self.conn.close)
+
+    async def acquire_priv(self, desired_priv):
+        return await run_blocking(self.conn.acquire_priv, desired_priv)
+
+    async def send_command(self, *args, **kwargs):
+        return await run_blocking(self.conn.send_command, *args, **kwargs)
+
+    async def send_commands(self, *args, **kwargs):
+        return await run_blocking(self.conn.send_commands, *args, **kwargs)
+
+    async def send_interactive(self, *args, **kwargs):
+        return await run_blocking(self.conn.send_interactive, *args, **kwargs)
+
+    async def send_config(self, *args, **kwargs):
+        return await run_blocking(self.conn.send_config, *args, **kwargs)
+
+    async def send_configs(self, *args, **kwargs):
+        return await run_blocking(self.conn.send_configs, *args, **kwargs)
+
+
+@functools.lru_cache(maxsize=None)
+def threaded(driver_class):
+    """ThreadedDriver over a given platform's blocking driver."""
+    return type(f"Threaded{driver_class.__name__}", (ThreadedDriver,), {"driver_class": driver_class})
+
+
+def shutdown():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(cancel_futures=True)
+        _executor = None
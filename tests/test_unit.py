@@ -1,9 +1,31 @@
 from fastapi.testclient import TestClient
-from network_device_api.main import app, Interface, config_templates
-import mock, scrapli
+from network_device_api.main import app, cache, cache_key, invalidate_device, snapshots, templates, refresh_device, Interface, config_templates
+from network_device_api.bulk import fan_out
+from network_device_api.cache import Cache
+from network_device_api.compression import Compressor, negotiate
+from network_device_api.inventory import Device, Inventory, Platform
+from network_device_api.jobs import JobManager
+from network_device_api import connect_device, offline_parse, parsing, transports
+from network_device_api import templates as ttp_templates
+from network_device_api.pagination import Page, paginate
+from network_device_api.poller import Poller
+from network_device_api.projection import Projection
+from network_device_api.snapshots import SnapshotStore, content_hash, diff
+from network_device_api.pool import ConnectionPool, DeviceBusy, DeviceLimiter
+from network_device_api.singleflight import SingleFlight
+from concurrent.futures import ProcessPoolExecutor
+import mock, scrapli, asyncio, io, json, pytest, sqlite3, tarfile, threading, time, zlib
 
 client = TestClient(app)
 
+@pytest.fixture(autouse=True)
+def clear_caches():
+    cache.clear()
+    snapshots.clear()
+    parsing.parser_registry.cache_clear()
+    parsing.find_parser.cache_clear()
+    parsing.clear_memo()
+
 def test_config_templates():
     interface = Interface(name="gi0/0")
     assert config_templates(interface) == "interface gi0/0"
@@ -23,10 +45,28 @@ def test_api_root():
     assert response.status_code == 200
     assert response.json() == {"message": "Network Device API"}
 
+def test_supported_commands():
+    response = client.get("/supported-commands/")
+    assert response.status_code == 200
+    assert "show ip interface brief" in response.json()["detail"]
+
+def test_startup_metrics():
+    with mock.patch('network_device_api.parsing.PARSE_PREWARM', True), \
+         mock.patch('network_device_api.parsing.prewarm', mock.MagicMock(return_value=["show vlan"])) as prewarm:
+        with TestClient(app) as startup_client:
+            response = startup_client.get("/metrics/startup/")
+
+        assert "show ip interface brief" in prewarm.call_args.args[0]
+        assert prewarm.call_args.args[1] == ("iosxe",)
+        detail = response.json()["detail"]
+        assert detail["prewarmed_commands"] == ["show vlan"]
+        assert detail["import_seconds"] <= detail["ready_seconds"]
+        assert "prewarm_seconds" in detail
+
 def test_show_vlans():
-    send_command = mock.MagicMock()
+    send_command = mock.AsyncMock(return_value={})
 
-    with mock.patch('network_device_api.main.send_command', send_command):
+    with mock.patch('network_device_api.main.async_send_command', send_command):
         response = client.get("/1.1.1.1/vlans/")
         assert response.status_code == 200
         assert "1.1.1.1" in send_command.call_args.args
@@ -35,7 +75,7 @@ def test_show_vlans():
         assert "detail" in response.json()
 
     send_command.reset_mock()
-    with mock.patch('network_device_api.main.send_command', send_command):
+    with mock.patch('network_device_api.main.async_send_command', send_command):
         response = client.get("/1.1.1.1/vlans/?vlan_id=666")
         assert response.status_code == 200        
         assert "1.1.1.1" in send_command.call_args.args
@@ -43,8 +83,8 @@ def test_show_vlans():
         assert response.json()["message"] == "Command executed sucessfully"
         assert "detail" in response.json()
     
-    send_command = mock.MagicMock(side_effect=scrapli.exceptions.ScrapliAuthenticationFailed)
-    with mock.patch('network_device_api.main.send_command', send_command):
+    send_command = mock.AsyncMock(side_effect=scrapli.exceptions.ScrapliAuthenticationFailed)
+    with mock.patch('network_device_api.main.async_send_command', send_command):
         response = client.get("/2.2.2.2/vlans/")
         assert response.status_code == 404
         assert "2.2.2.2" in send_command.call_args.args
@@ -54,9 +94,9 @@ def test_show_vlans():
             }
 
 def test_show_ip_interfaces():
-    send_command = mock.MagicMock()
+    send_command = mock.AsyncMock(return_value={})
 
-    with mock.patch('network_device_api.main.send_command', send_command):
+    with mock.patch('network_device_api.main.async_send_command', send_command):
         response = client.get("/1.1.1.1/ip-interfaces/")
         assert response.status_code == 200
         assert "1.1.1.1" in send_command.call_args.args
@@ -64,8 +104,8 @@ def test_show_ip_interfaces():
         assert response.json()["message"] == "Command executed sucessfully"
         assert "detail" in response.json()
 
-    send_command = mock.MagicMock(side_effect=scrapli.exceptions.ScrapliAuthenticationFailed)
-    with mock.patch('network_device_api.main.send_command', send_command):
+    send_command = mock.AsyncMock(side_effect=scrapli.exceptions.ScrapliAuthenticationFailed)
+    with mock.patch('network_device_api.main.async_send_command', send_command):
         response = client.get("/2.2.2.2/ip-interfaces/")
         assert response.status_code == 404
         assert "2.2.2.2" in send_command.call_args.args
@@ -75,9 +115,9 @@ def test_show_ip_interfaces():
             }
 
 def test_show_interfaces():
-    send_command = mock.MagicMock()
+    send_command = mock.AsyncMock(return_value={})
 
-    with mock.patch('network_device_api.main.send_command', send_command):
+    with mock.patch('network_device_api.main.async_send_command', send_command):
         response = client.get("/1.1.1.1/interfaces/")
         assert response.status_code == 200
         assert "1.1.1.1" in send_command.call_args.args
@@ -86,7 +126,7 @@ def test_show_interfaces():
         assert "detail" in response.json()
 
     send_command.reset_mock()
-    with mock.patch('network_device_api.main.send_command', send_command):
+    with mock.patch('network_device_api.main.async_send_command', send_command):
         response = client.get("/1.1.1.1/interfaces/?interface_name=loopback0")
         assert response.status_code == 200        
         assert "1.1.1.1" in send_command.call_args.args
@@ -94,8 +134,8 @@ def test_show_interfaces():
         assert response.json()["message"] == "Command executed sucessfully"
         assert "detail" in response.json()
 
-    send_command = mock.MagicMock(side_effect=scrapli.exceptions.ScrapliAuthenticationFailed)
-    with mock.patch('network_device_api.main.send_command', send_command):
+    send_command = mock.AsyncMock(side_effect=scrapli.exceptions.ScrapliAuthenticationFailed)
+    with mock.patch('network_device_api.main.async_send_command', send_command):
         response = client.get("/2.2.2.2/interfaces/")
         assert response.status_code == 404
         assert "2.2.2.2" in send_command.call_args.args
@@ -105,9 +145,9 @@ def test_show_interfaces():
             }
 
 def test_configure_interfaces():
-    send_config = mock.MagicMock()
+    send_config = mock.AsyncMock(return_value={})
 
-    with mock.patch('network_device_api.main.send_config', send_config):
+    with mock.patch('network_device_api.main.async_send_config', send_config):
         payload = {
             'name': 'gi0/0', 
             'description': 'testint', 
@@ -119,8 +159,8 @@ def test_configure_interfaces():
         assert 'interface gi0/0\ndescription testint\nshutdown' in send_config.call_args.args
         assert response.json()["message"] == "Config changed sucessfully"
 
-    send_config = mock.MagicMock(side_effect=scrapli.exceptions.ScrapliAuthenticationFailed)
-    with mock.patch('network_device_api.main.send_config', send_config):
+    send_config = mock.AsyncMock(side_effect=scrapli.exceptions.ScrapliAuthenticationFailed)
+    with mock.patch('network_device_api.main.async_send_config', send_config):
         response = client.post("/2.2.2.2/interfaces/", json=payload)
         assert response.status_code == 404
         assert "2.2.2.2" in send_config.call_args.args
@@ -128,11 +168,55 @@ def test_configure_interfaces():
             "detail": "Timed out connecting to host, does it exist?"
             }
 
+def test_configure_interfaces_batch():
+    def config_response(channel_input, failed=False):
+        return mock.MagicMock(channel_input=channel_input, failed=failed, result="% Invalid input detected" if failed else "")
+
+    payload = [
+        {"name": "gi0/1", "description": "one"},
+        {"name": "gi0/2", "ip_address": "1.2.3.4 255.255.255.0"},
+        {"name": "gi0/3", "enabled": True},
+    ]
+    responses = [
+        config_response("interface gi0/1"), config_response("description one"),
+        config_response("interface gi0/2"), config_response("ip address 1.2.3.4 255.255.255.0", failed=True),
+        config_response("interface gi0/3"), config_response("no shutdown"),
+    ]
+    send_configs = mock.AsyncMock(return_value=responses)
+    cache.set(("1.1.1.1", "show interfaces", None), {})
+
+    with mock.patch('network_device_api.main.async_send_configs', send_configs):
+        response = client.post("/1.1.1.1/interfaces/batch/", json=payload)
+        assert response.status_code == 207
+        assert send_configs.call_args.args == ("1.1.1.1", [
+            "interface gi0/1", "description one",
+            "interface gi0/2", "ip address 1.2.3.4 255.255.255.0",
+            "interface gi0/3", "no shutdown",
+        ])
+        assert response.json()["detail"] == [
+            {"name": "gi0/1", "status": "configured"},
+            {"name": "gi0/2", "status": "failed", "detail": "% Invalid input detected"},
+            {"name": "gi0/3", "status": "configured"},
+        ]
+        assert len(cache) == 0
+
+    send_configs = mock.AsyncMock(return_value=responses[:4])
+    with mock.patch('network_device_api.main.async_send_configs', send_configs):
+        response = client.post("/1.1.1.1/interfaces/batch/?stop_on_failure=true", json=payload)
+        assert send_configs.call_args.kwargs["stop_on_failed"] is True
+        assert [result["status"] for result in response.json()["detail"]] == ["configured", "failed", "skipped"]
+
+    send_configs = mock.AsyncMock(return_value=responses[:2])
+    with mock.patch('network_device_api.main.async_send_configs', send_configs):
+        response = client.post("/1.1.1.1/interfaces/batch/", json=payload[:1])
+        assert response.status_code == 201
+        assert response.json()["message"] == "Config changed sucessfully"
+
 
 def test_show_run_interfaces():
-    send_command = mock.MagicMock()
+    send_command = mock.AsyncMock(return_value={})
 
-    with mock.patch('network_device_api.main.send_command', send_command):
+    with mock.patch('network_device_api.main.async_send_command', send_command):
         response = client.get("/1.1.1.1/interfaces-config/?interface_name=loopback0")
         assert response.status_code == 200
         assert "1.1.1.1" in send_command.call_args.args
@@ -140,8 +224,8 @@ def test_show_run_interfaces():
         assert response.json()["message"] == "Command executed sucessfully"
         assert "detail" in response.json()
 
-    send_command = mock.MagicMock(side_effect=scrapli.exceptions.ScrapliAuthenticationFailed)
-    with mock.patch('network_device_api.main.send_command', send_command):
+    send_command = mock.AsyncMock(side_effect=scrapli.exceptions.ScrapliAuthenticationFailed)
+    with mock.patch('network_device_api.main.async_send_command', send_command):
         response = client.get("/2.2.2.2/interfaces-config/?interface_name=loopback0")
         assert response.status_code == 404
         assert "2.2.2.2" in send_command.call_args.args
@@ -156,154 +240,983 @@ def test_show_run_interfaces():
         "detail": "No interface specified!"
         }
     
+def fake_driver(response=None, error=None):
+    """Driver class mock whose instances behave like an open AsyncIOSXEDriver."""
+    def make_conn(**settings):
+        conn = mock.AsyncMock()
+        conn.isalive = mock.MagicMock(return_value=True)
+        conn.send_command.return_value = response
+        conn.send_command.side_effect = error
+        return conn
+    return mock.MagicMock(side_effect=make_conn)
 
-# Tests for possible cache implementation
-
-# def test_supported_command():
-#     allowed_commands = ["show vlan"]
-#     not_allowed_commands = ["show ipx 123"]
-#     for command in allowed_commands:
-#         assert supported_command(command) == True
-#     for command in not_allowed_commands:
-#         assert supported_command(command) == False
-   
-# def test_show_command():
-#     command = "show vlan"
-#     device_ip = "10.2.32.33"
-#     with mock.patch('network_device_api.main.send_command', lambda device_ip, command, **kwargs:  {"device_ip":device_ip, "command": command}):
-#         response = client.get(f"/{device_ip}/{command}")
-#         assert response.status_code == 200
-#         assert response.json() == {"message": "Command executed sucessfully", "detail": {"device_ip":device_ip, "command": command}}
-    
-    # command = "show ip bgp"
-    # device_ip = "10.2.32.33"
-    # response = client.get(f"/show/{device_ip}/{command}")
-    # assert response.status_code == 400
-    # assert response.json() == {"detail": f"Command failed, command not supported {command}"}
-
-# def test_cache():
-#     cache = Cache({"foo": 1, "bar":["foo", 2]})
-#     assert isinstance(cache, Cache)
-#     assert cache.cache == {"foo": 1, "bar":["foo", 2]}
-
-#     cache.clear()
-#     assert cache.cache == {}
-
-#     send_command = mock.MagicMock()
-#     send_command.return_value = {'interface': {
-#                                         'GigabitEthernet0/0': {
-#                                             'interface_is_ok': 'YES',
-#                                             'ip_address': 'unassigned',
-#                                             'method': 'unset',
-#                                             'protocol': 'down',
-#                                             'status': 'down'
-#                                                 }}}
-#     with mock.patch('network_device_api.main.send_command', send_command):
-#         cache.update("1.1.1.1", "show ip interface brief")
-#         assert "1.1.1.1" in cache.cache
-#         assert cache.cache == {'1.1.1.1': {'interface': {'GigabitEthernet0/0': {'interface_is_ok': 'YES',
-#                                                  'ip_address': 'unassigned',
-#                                                  'method': 'unset',
-#                                                  'protocol': 'down',
-#                                                  'status': 'down'}}}}
-
-#     cache.clear()
-#     assert cache.cache == {}
+def fake_platform(driver=None, async_driver=None):
+    """Swap the drivers the inventory hands out for cisco_iosxe, the default platform."""
+    platform = Platform(driver or mock.MagicMock(), async_driver or mock.MagicMock(), "iosxe")
+    return mock.patch.dict('network_device_api.inventory.PLATFORMS', {"cisco_iosxe": platform})
 
-    
-#     cache.cache = {'1.1.1.1': {'vlans': {'1': {
-#                                             'interfaces': ['TwentyFiveGigE1/0/2'],
-#                                             'mtu': 1500,
-#                                             'name': 'default',
-#                                             'said': 100001,
-#                                             'shutdown': False,
-#                                             'state': 'active',
-#                                             'trans1': 0,
-#                                             'trans2': 0,
-#                                             'type': 'enet',
-#                                             'vlan_id': '1' }}}}
-#     device_ip = "1.1.1.1"
-#     command = "show vlan"
-#     send_command = mock.MagicMock()
-#     send_command.return_value = {'vlans': {
-#             '1': {
-#                 'interfaces': [
-#                     'TwentyFiveGigE1/0/2',
-#                     ],
-#                 'mtu': 1500,
-#                 'name': 'default',
-#                 'said': 100001,
-#                 'shutdown': False,
-#                 'state': 'active',
-#                 'trans1': 0,
-#                 'trans2': 0,
-#                 'type': 'enet',
-#                 'vlan_id': '1'
-#                 }}}
-#     with mock.patch('network_device_api.main.send_command', send_command):
-#         assert cache.retrieve_from_cache(device_ip, command) == {'vlans': {
-#             '1': {
-#                 'interfaces': [
-#                     'TwentyFiveGigE1/0/2',
-#                     ],
-#                 'mtu': 1500,
-#                 'name': 'default',
-#                 'said': 100001,
-#                 'shutdown': False,
-#                 'state': 'active',
-#                 'trans1': 0,
-#                 'trans2': 0,
-#                 'type': 'enet',
-#                 'vlan_id': '1'
-#                 }}}
-#         send_command.assert_not_called()
-
-# def test_show_vlans():
-#     cache = Cache()
-#     cache.cache = {'1.1.1.1':{'vlans': {'1': {
-#                                                 'interfaces': ['TwentyFiveGigE1/0/2'],
-#                                                 'mtu': 1500,
-#                                                 'name': 'default',
-#                                                 'said': 100001,
-#                                                 'shutdown': False,
-#                                                 'state': 'active',
-#                                                 'trans1': 0,
-#                                                 'trans2': 0,
-#                                                 'type': 'enet',
-#                                                 'vlan_id': '1' },
-#                                             '2': {
-#                                                 'interfaces': ['TwentyFiveGigE1/0/2'],
-#                                                 'mtu': 1500,
-#                                                 'name': 'default',
-#                                                 'said': 100001,
-#                                                 'shutdown': False,
-#                                                 'state': 'active',
-#                                                 'trans1': 0,
-#                                                 'trans2': 0,
-#                                                 'type': 'enet',
-#                                                 'vlan_id': '2' },
-#                                             }}}
-#     with mock.patch('network_device_api.main.cache', cache):
-#         response = client.get("/1.1.1.1/vlans")
-#         assert response.status_code == 200
-#         assert response.json() == {    
-#             "message": "Command executed sucessfully",
-#             "detail": cache.cache['1.1.1.1']['show vlan']      
-#             }
-
-#     send_command = mock.MagicMock(side_effect=HTTPException(status_code=404, detail='Timed out connecting to host, does it exist?'))
-#     with mock.patch('network_device_api.main.send_command', send_command):
-#         response = client.get("/1.1.1.2/vlans")
-#         assert response.status_code == 404
-#         assert response.json() == {
-#             "detail": "Timed out connecting to host, does it exist?"
-#             }
-        
-#     with mock.patch('network_device_api.main.cache', cache):
-#         response = client.get("/1.1.1.1/vlans/?vlan_id=2")
-#         assert response.status_code == 200
-#         assert response.json() == {    
-#             "message": "Command executed sucessfully",
-#             "detail": cache.cache['1.1.1.1']['show vlan']['vlans']['2']
-#             }
-    
\ No newline at end of file
+class FakeGenieDevice():
+    def __init__(self, name, os, **kwargs):
+        self.os = os
+
+def fake_parser(result):
+    parser_class = mock.MagicMock()
+    parser_class.return_value.parse.return_value = result
+    return parser_class
+
+def fake_genie(parsers):
+    """Genie stand in resolving commands from a dict of command -> parser class."""
+    def get_parser(command, device):
+        if command not in parsers:
+            raise Exception("Could not find parser")
+        return parsers[command], {}
+    parsing.parser_registry.cache_clear()
+    parsing.find_parser.cache_clear()
+    parsing._genie_device.cache_clear()
+    return mock.patch('network_device_api.parsing._genie', mock.MagicMock(return_value=(FakeGenieDevice, get_parser)))
+
+def device_response(result, genie_result=None):
+    response = mock.MagicMock(result=result, channel_input="show vlan", genie_platform="iosxe", textfsm_platform="cisco_iosxe")
+    return response, fake_genie({"show vlan": fake_parser(genie_result)} if genie_result else {})
+
+def test_async_send_command():
+    response, genie_parse = device_response("raw output")
+    driver = fake_driver(response)
+
+    with fake_platform(async_driver=driver), \
+         mock.patch('network_device_api.connect_device.pool', ConnectionPool()):
+        with genie_parse:
+            assert asyncio.run(connect_device.async_send_command("1.1.1.1", "show clock", username="admin")) == "raw output"
+        assert driver.call_args.kwargs["host"] == "1.1.1.1"
+        assert driver.call_args.kwargs["transport"] == "asyncssh"
+
+        response, genie_parse = device_response("raw output", {"vlans": {}})
+        driver.side_effect = None
+        driver.return_value.send_command.return_value = response
+        with genie_parse:
+            assert asyncio.run(connect_device.async_send_command("1.1.1.1", "show vlan", username="admin")) == {"vlans": {}}
+
+def test_async_send_command_coalesced():
+    response, genie_parse = device_response("raw output", {"vlans": {}})
+    driver = fake_driver(response)
+
+    async def storm():
+        return await asyncio.gather(
+            *[connect_device.async_send_command("1.1.1.1", "show vlan", username="admin") for _ in range(50)],
+            connect_device.async_send_command("1.1.1.1", "show  vlan", username="admin"),
+            connect_device.async_send_command("2.2.2.2", "show vlan", username="admin"),
+            connect_device.async_send_command("2.2.2.2", "show VLAN", username="admin"),
+        )
+
+    send = mock.MagicMock(wraps=connect_device._async_send_command)
+    with fake_platform(async_driver=driver), \
+         mock.patch('network_device_api.connect_device.pool', ConnectionPool()), \
+         mock.patch('network_device_api.connect_device._async_send_command', send), genie_parse:
+        results = asyncio.run(storm())
+        assert results == [{"vlans": {}}] * 53
+        # One device call per host and command, however many clients asked. Commands that differ in
+        # case aren't merged, filters such as `| include` are case sensitive
+        assert sorted(call.args[:2] for call in send.call_args_list) == [
+            ("1.1.1.1", "show vlan"), ("2.2.2.2", "show VLAN"), ("2.2.2.2", "show vlan")]
+        assert len(connect_device.flight) == 0
+
+def test_single_flight_errors_shared():
+    flight = SingleFlight()
+    calls = []
+
+    async def fail():
+        calls.append(1)
+        await asyncio.sleep(0)
+        raise scrapli.exceptions.ScrapliAuthenticationFailed
+
+    async def storm():
+        return await asyncio.gather(*[flight.do("key", fail) for _ in range(5)], return_exceptions=True)
+
+    results = asyncio.run(storm())
+    assert len(calls) == 1
+    assert all(isinstance(result, scrapli.exceptions.ScrapliAuthenticationFailed) for result in results)
+
+def test_parser_registry():
+    show_vlan, show_vlan_id, show_version = fake_parser({"vlans": {}}), fake_parser({"vlan-id": 10}), fake_parser({"version": {}})
+    get_parser = mock.MagicMock(side_effect=lambda command, device: ({"show vlan": show_vlan, "show vlan id 1": show_vlan_id, "show version": show_version}[command], {}))
+
+    with fake_genie({}) as genie:
+        genie.return_value = (FakeGenieDevice, get_parser)
+
+        assert parsing.parse_output("raw", "show vlan") == {"vlans": {}}
+        assert parsing.parse_output("raw", "show vlan id 10") == {"vlan-id": 10}
+        show_vlan_id.return_value.parse.assert_called_once_with(output="raw", vlan_id="10")
+
+        # Supported commands never hit Genie's fuzzy lookup again, others only once
+        lookups = get_parser.call_count
+        parsing.parse_output("raw", "show vlan")
+        parsing.parse_output("raw", "show version")
+        parsing.parse_output("raw", "show version")
+        assert get_parser.call_count == lookups + 1
+
+        # No parser means no parsing at all, the raw output comes straight back
+        assert parsing.parse_output("raw clock", "show clock") == "raw clock"
+        parsing.parse_output("raw clock", "show clock")
+        assert get_parser.call_count == lookups + 2
+
+def test_interface_subcommands():
+    show_interfaces, show_status = fake_parser({"GigabitEthernet1": {}}), fake_parser({"interfaces": {}})
+    parsers = {"show interfaces": show_interfaces, "show interfaces GigabitEthernet1": show_interfaces,
+               "show interfaces status": show_status}
+
+    with fake_genie(parsers):
+        assert parsing.find_parser("show interfaces Gi1/0/1") == (show_interfaces, {"interface": "Gi1/0/1"})
+        assert parsing.find_parser("show interface Port-channel 10") == (show_interfaces, {"interface": "Port-channel 10"})
+        # Subcommands go to their own Genie parser rather than `show interfaces <name>`
+        assert parsing.find_parser("show interfaces status") == (show_status, {})
+        assert parsing.find_parser("show interfaces trunk") is None
+
+def test_parse_memo():
+    show_vlan = fake_parser({"vlans": {"1": {}}})
+
+    with fake_genie({"show vlan": show_vlan}):
+        # A fleet of identical switches only costs one parse
+        for _ in range(3):
+            assert parsing.parse_output("VLAN Name\n1 default", "show vlan") == {"vlans": {"1": {}}}
+        assert show_vlan.return_value.parse.call_count == 1
+
+        parsing.parse_output("VLAN Name\n2 users", "show vlan")
+        parsing.parse_output("VLAN Name\n1 default", "show vlan", genie_platform="ios")
+        assert show_vlan.return_value.parse.call_count == 3
+
+        # Already parsed output never goes to a worker
+        with mock.patch('network_device_api.parsing.get_executor', mock.MagicMock(side_effect=AssertionError)):
+            assert asyncio.run(parsing.async_parse_output("VLAN Name\n1 default", "show  vlan")) == {"vlans": {"1": {}}}
+
+        assert connect_device._test_command("VLAN Name\n1 default", channel_input="show vlan") == {"vlans": {"1": {}}}
+        assert connect_device._test_command("raw clock", channel_input="show clock") == []
+        assert show_vlan.return_value.parse.call_count == 3
+
+def test_async_parse_output_process_pool():
+    with mock.patch('network_device_api.parsing.PARSE_WORKERS', 1):
+        try:
+            result = asyncio.run(parsing.async_parse_output("% Invalid input detected", "show foo"))
+            assert result == "% Invalid input detected"
+            assert isinstance(parsing.get_executor(), ProcessPoolExecutor)
+            # Never forked from this (threaded) process
+            assert parsing.get_executor()._mp_context.get_start_method() == "forkserver"
+            # Unparsed output coming back from a worker isn't memoised either
+            assert len(parsing._memo) == 0
+        finally:
+            parsing.shutdown()
+
+    assert parsing.get_executor() is None
+
+def test_threaded_transport():
+    threads, conns = [], []
+    def make_conn(**settings):
+        conn = mock.MagicMock()
+        conns.append(conn)
+        conn.send_command.side_effect = lambda command: threads.append(threading.current_thread().name) or \
+            mock.MagicMock(result="raw output", channel_input=command, genie_platform="iosxe", textfsm_platform="cisco_iosxe")
+        return conn
+    driver = mock.MagicMock(side_effect=make_conn, __name__="IOSXEDriver")
+
+    with mock.patch('network_device_api.connect_device.SSH_TRANSPORT', "paramiko"), \
+         fake_platform(driver=driver), \
+         mock.patch('network_device_api.connect_device.pool', ConnectionPool()), fake_genie({}):
+        assert asyncio.run(connect_device.async_send_command("1.1.1.1", "show clock")) == "raw output"
+
+    assert driver.call_args.kwargs["transport"] == "paramiko"
+    conns[0].open.assert_called_once()
+    # The blocking driver is only ever touched from a transport thread
+    assert threads[0].startswith("transport")
+
+    conn = transports.threaded(driver)(host="1.1.1.1")
+    asyncio.run(conn.acquire_priv("privilege_exec"))
+    conns[-1].acquire_priv.assert_called_once_with("privilege_exec")
+
+def test_check_transport():
+    transports.check_transport("asyncssh")
+    with pytest.raises(ValueError, match="must be one of"):
+        transports.check_transport("telnet")
+
+    # paramiko and ssh2 only work when their extra is installed
+    with mock.patch('importlib.util.find_spec', mock.MagicMock(return_value=None)):
+        transports.check_transport("system")
+        with pytest.raises(ValueError, match=r"network-device-api\[ssh2\]"):
+            transports.check_transport("ssh2")
+        with pytest.raises(ValueError, match="^sw1: the paramiko transport"):
+            Device("10.0.0.1", name="sw1", transport="paramiko")
+
+def test_connection_pool():
+    pool = ConnectionPool(max_sessions=2, idle_ttl=60)
+    driver = fake_driver()
+    settings = {"host": "1.1.1.1", "auth_username": "admin"}
+    send = lambda conn: conn.send_command("show clock")
+
+    async def run_twice():
+        first = await pool.run(settings, driver, send)
+        second = await pool.run(settings, driver, send)
+        return first, second
+
+    asyncio.run(run_twice())
+    assert driver.call_count == 1
+
+    # Dead sessions are not reused
+    conn = pool._idle[("1.1.1.1", "admin")][0][0]
+    conn.isalive.return_value = False
+    asyncio.run(pool.run(settings, driver, send))
+    assert driver.call_count == 2
+    conn.close.assert_awaited()
+
+    # Idle sessions past their TTL are evicted
+    pool.idle_ttl = 0
+    assert asyncio.run(pool.evict_idle()) == 1
+    assert pool._idle == {}
+
+def test_evict_idle_during_checkout():
+    pool = ConnectionPool(max_sessions=2, idle_ttl=60)
+    key, settings = ("1.1.1.1", "admin"), {"host": "1.1.1.1", "auth_username": "admin"}
+    live, expired = fake_driver()(), fake_driver()()
+    checked_out = []
+
+    async def close():
+        # A request checks a session out while the expired one is being closed
+        checked_out.append(await pool._checkout(key, settings, fake_driver()))
+    expired.close.side_effect = close
+    pool._idle[key] = [(live, time.monotonic()), (expired, 0)]
+
+    assert asyncio.run(pool.evict_idle()) == 1
+    assert checked_out == [(live, True)]
+    # The session in use must not also be listed as idle
+    assert not pool._idle.get(key)
+
+def test_connection_pool_reconnect():
+    pool = ConnectionPool(max_sessions=1, idle_ttl=60)
+    driver = fake_driver()
+    settings = {"host": "1.1.1.1", "auth_username": "admin"}
+    asyncio.run(pool.run(settings, driver, lambda conn: conn.send_command("show clock")))
+
+    # Device dropped the VTY line on the pooled session, a fresh one is opened transparently
+    stale = pool._idle[("1.1.1.1", "admin")][0][0]
+    stale.send_command.side_effect = scrapli.exceptions.ScrapliConnectionError
+    asyncio.run(pool.run(settings, driver, lambda conn: conn.send_command("show clock")))
+    assert driver.call_count == 2
+    assert pool._idle[("1.1.1.1", "admin")][0][0] is not stale
+
+    # A fresh session failing is a real error though
+    driver = fake_driver(error=scrapli.exceptions.ScrapliConnectionError)
+    pool._idle = {}
+    with pytest.raises(scrapli.exceptions.ScrapliConnectionError):
+        asyncio.run(pool.run(settings, driver, lambda conn: conn.send_command("show clock")))
+
+def stream_driver(chunks):
+    """Driver class mock whose sessions echo the command, then send chunks and a prompt."""
+    def make_conn(**settings):
+        conn = fake_driver()()
+        conn.comms_prompt_pattern = r"^[a-z0-9.\-@()/:]{1,32}[#>$]$"
+        conn.default_desired_privilege_level = "privilege_exec"
+        conn.timeout_ops = 5
+        conn.channel = mock.MagicMock()
+        conn.channel.read = mock.AsyncMock(side_effect=[b"show run\nBuilding", *chunks, b"csr1000v#"])
+        return conn
+    return mock.MagicMock(side_effect=make_conn)
+
+def test_async_stream_command():
+    pool = ConnectionPool(max_sessions=1, idle_ttl=60)
+    driver = stream_driver([b" configuration...\n\nhostname csr", b"1000v\n!\nend\n"])
+
+    async def collect():
+        return [chunk async for chunk in connect_device.async_stream_command("1.1.1.1", "show run")]
+
+    with mock.patch('network_device_api.connect_device.pool', pool), \
+            fake_platform(async_driver=driver):
+        chunks = asyncio.run(collect())
+        assert b"".join(chunks) == b"Building configuration...\n\nhostname csr1000v\n!\nend\n"
+        assert len(chunks) == 2
+        # Finished cleanly so the session goes back in the pool
+        assert len(pool._idle[("1.1.1.1", None)]) == 1
+        # Out of config mode before the command is written, the session may be left there by a push
+        conn = pool._idle[("1.1.1.1", None)][0][0]
+        conn.acquire_priv.assert_awaited_once_with("privilege_exec")
+
+        async def abandon():
+            chunks = connect_device.async_stream_command("2.2.2.2", "show run")
+            await anext(chunks)
+            await chunks.aclose()
+
+        asyncio.run(abandon())
+        assert ("2.2.2.2", None) not in pool._idle
+
+def test_stream_raw_command():
+    async def stream_command(host, command, **kwargs):
+        yield b"line 1\n"
+        yield b"line 2\n"
+
+    with mock.patch('network_device_api.main.async_stream_command', stream_command):
+        response = client.get("/1.1.1.1/raw/?command=show tech-support")
+        assert response.status_code == 200
+        assert response.text == "line 1\nline 2\n"
+
+    assert client.get("/1.1.1.1/raw/?command=reload").status_code == 400
+
+def test_command_injection():
+    send = mock.AsyncMock(side_effect=AssertionError("nothing should reach the device"))
+    injected = ["show clock\nconfigure terminal\nno ip routing\nend", "show clock\rreload", "show clock\x00"]
+
+    with mock.patch('network_device_api.main.async_send_command', send), \
+         mock.patch('network_device_api.main.async_send_commands', send), \
+         mock.patch('network_device_api.main.async_stream_command', send):
+        for command in injected:
+            for route in ("/bulk/command/", "/bulk/command/stream/", "/jobs/bulk/command/"):
+                assert client.post(route, json={"hosts": ["1.1.1.1"], "command": command}).status_code == 422
+            assert client.post("/1.1.1.1/commands/", json={"commands": ["show vlan", command]}).status_code == 422
+            response = client.get("/1.1.1.1/raw/", params={"command": command})
+            assert response.status_code == 400
+            assert "control characters" in response.json()["detail"]
+
+def test_device_limiter():
+    limiter = DeviceLimiter("1.1.1.1", max_sessions=1, queue_depth=1, queue_timeout=0.05)
+
+    async def hold(seconds):
+        async with limiter.slot():
+            await asyncio.sleep(seconds)
+
+    async def saturate():
+        return await asyncio.gather(hold(0.2), hold(0), hold(0), return_exceptions=True)
+
+    # One session in use, one request queued behind it, the third is turned away straight away
+    # and the queued one gives up waiting
+    results = asyncio.run(saturate())
+    assert results[0] is None
+    assert isinstance(results[1], DeviceBusy) and not results[1].queue_full
+    assert isinstance(results[2], DeviceBusy) and results[2].queue_full
+    assert results[2].retry_after >= 1
+    assert limiter.waiting == 0
+
+def test_device_busy():
+    send_command = mock.AsyncMock(side_effect=DeviceBusy("1.1.1.1", 3, queue_full=True))
+    with mock.patch('network_device_api.main.async_send_command', send_command):
+        response = client.get("/1.1.1.1/vlans/")
+        assert response.status_code == 429
+        assert response.headers["retry-after"] == "3"
+
+    send_command = mock.AsyncMock(side_effect=DeviceBusy("1.1.1.1", 5, queue_full=False))
+    with mock.patch('network_device_api.main.async_send_command', send_command):
+        response = client.get("/1.1.1.1/vlans/")
+        assert response.status_code == 503
+        assert response.headers["retry-after"] == "5"
+
+def test_cache():
+    cache = Cache(maxsize=2, default_ttl=10, ttls={"show vlan": 60, "show vlan id": 5})
+    assert cache.ttl_for("show  VLAN") == 60
+    assert cache.ttl_for("show vlan id 10") == 5
+    assert cache.ttl_for("show clock") == 10
+    # Filters are case sensitive, so only whitespace is normalised in keys
+    assert cache_key("1.1.1.1", "show  run | include Vlan10") == cache_key("1.1.1.1", "show run | include Vlan10")
+    assert cache_key("1.1.1.1", "show run | include Vlan10") != cache_key("1.1.1.1", "show run | include vlan10")
+
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a").value == 1
+    # "b" is now least recently used so is evicted first
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert len(cache) == 2
+
+    cache.set("d", 4, ttl=0)
+    assert cache.get("d") is None
+    assert cache.invalidate(lambda key: key == "c") == 1
+    assert Cache().cache is not Cache().cache
+
+def test_show_vlans_cached():
+    send_command = mock.AsyncMock(return_value={"vlans": {"1": {"name": "default"}}})
+
+    with mock.patch('network_device_api.main.async_send_command', send_command):
+        response = client.get("/1.1.1.1/vlans/")
+        assert response.headers["cache-control"] == "max-age=60"
+        assert response.headers["age"] == "0"
+
+        response = client.get("/1.1.1.1/vlans/")
+        assert response.json()["detail"] == {"vlans": {"1": {"name": "default"}}}
+        assert send_command.await_count == 1
+
+        response = client.get("/1.1.1.1/vlans/", headers={"Cache-Control": "no-cache"})
+        assert send_command.await_count == 2
+
+        response = client.delete("/cache/?device_ip=1.1.1.1&command=show%20vlan")
+        assert response.json() == {"message": "Cache invalidated", "detail": {"invalidated": 1}}
+        client.get("/1.1.1.1/vlans/")
+        assert send_command.await_count == 3
+
+def test_show_commands():
+    send_commands = mock.AsyncMock(return_value=[{"vlans": {}}, {"interface": {}}])
+    cache.set(("1.1.1.1", "show interfaces", None), {"Loopback0": {}})
+
+    with mock.patch('network_device_api.main.async_send_commands', send_commands):
+        payload = {"commands": ["show vlan", "show ip interface brief", "show interfaces"]}
+        response = client.post("/1.1.1.1/commands/", json=payload)
+        assert response.status_code == 200
+        assert response.json()["detail"] == {
+            "show vlan": {"vlans": {}},
+            "show ip interface brief": {"interface": {}},
+            "show interfaces": {"Loopback0": {}},
+        }
+        # Only what wasn't cached went to the device, in one go
+        send_commands.assert_awaited_once()
+        assert send_commands.call_args.args == ("1.1.1.1", ["show vlan", "show ip interface brief"])
+
+        send_commands.reset_mock()
+        client.post("/1.1.1.1/commands/", json=payload)
+        send_commands.assert_not_awaited()
+
+    response = client.post("/1.1.1.1/commands/", json={"commands": ["show vlan", "reload"]})
+    assert response.status_code == 422
+
+def test_async_send_commands():
+    responses = [mock.MagicMock(result=f"raw {n}", channel_input="show clock", genie_platform="iosxe", textfsm_platform="cisco_iosxe") for n in range(2)]
+    driver = fake_driver()
+
+    with fake_platform(async_driver=driver), \
+         mock.patch('network_device_api.connect_device.pool', ConnectionPool()), fake_genie({}):
+        driver.side_effect = None
+        driver.return_value = mock.AsyncMock()
+        driver.return_value.send_commands.return_value = responses
+        results = asyncio.run(connect_device.async_send_commands("1.1.1.1", ["show clock", "show clock detail"]))
+        assert results == ["raw 0", "raw 1"]
+        driver.return_value.send_commands.assert_awaited_once_with(["show clock", "show clock detail"])
+        assert driver.call_count == 1
+
+def test_diff():
+    old = {"Gi1": {"oper_status": "up", "counters": {"in_pkts": 1}}, "Gi2": {"oper_status": "up"}}
+    new = {"Gi1": {"oper_status": "down", "counters": {"in_pkts": 1}}, "Gi3": {"oper_status": "up"}}
+    assert diff(old, new) == {
+        "added": [{"path": ["Gi3"], "value": {"oper_status": "up"}}],
+        "removed": [{"path": ["Gi2"]}],
+        "changed": [{"path": ["Gi1", "oper_status"], "value": "down"}],
+    }
+    assert diff(old, old) == {"added": [], "removed": [], "changed": []}
+    assert content_hash({"a": 1, "b": 2}) == content_hash({"b": 2, "a": 1})
+
+    store = SnapshotStore(maxsize=10, versions=2)
+    for version in "abc":
+        store.add("key", version, version)
+    assert store.get("key", "a") is None
+    assert store.get("key", "c") == "c"
+
+def test_show_interfaces_since():
+    outputs = [
+        {"Gi1": {"oper_status": "up"}, "Gi2": {"oper_status": "up"}},
+        {"Gi1": {"oper_status": "down"}, "Gi2": {"oper_status": "up"}},
+    ]
+    send_command = mock.AsyncMock(side_effect=outputs)
+
+    with mock.patch('network_device_api.main.async_send_command', send_command):
+        response = client.get("/1.1.1.1/interfaces/")
+        version = response.headers["x-snapshot-version"]
+        assert version == content_hash(outputs[0])
+
+        response = client.get(f"/1.1.1.1/interfaces/?since={version}", headers={"Cache-Control": "no-cache"})
+        assert response.json() == {
+            "message": "Command executed sucessfully",
+            "version": content_hash(outputs[1]),
+            "since": version,
+            "diff": {"added": [], "removed": [], "changed": [{"path": ["Gi1", "oper_status"], "value": "down"}]},
+        }
+
+        response = client.get("/1.1.1.1/interfaces/?since=unknown")
+        assert response.json()["detail"] == outputs[1]
+
+def test_show_vlans_etag():
+    send_command = mock.AsyncMock(return_value={"vlans": {"1": {"name": "default"}}})
+
+    with mock.patch('network_device_api.main.async_send_command', send_command):
+        response = client.get("/1.1.1.1/vlans/")
+        etag = response.headers["etag"]
+        assert etag == f'"{content_hash({"vlans": {"1": {"name": "default"}}})}"'
+
+        response = client.get("/1.1.1.1/vlans/", headers={"If-None-Match": f'"other", {etag}'})
+        assert response.status_code == 304
+        assert response.content == b""
+        assert response.headers["etag"] == etag
+        # Answered from the cache
+        assert send_command.await_count == 1
+
+        response = client.get("/1.1.1.1/vlans/", headers={"If-None-Match": '"other"'})
+        assert response.status_code == 200
+
+def test_compression():
+    assert negotiate("gzip, deflate") == "gzip"
+    assert negotiate("gzip;q=0, br") is None
+    assert negotiate("") is None
+
+    compressor = Compressor("gzip")
+    stream = compressor.compress(b"line 1\n", final=False)
+    # Each flushed chunk can be decoded on its own, so streamed lines aren't held back
+    decompressor = zlib.decompressobj(31)
+    assert decompressor.decompress(stream) == b"line 1\n"
+    assert decompressor.decompress(compressor.compress(b"line 2\n", final=True)) == b"line 2\n"
+
+    vlans = {"vlans": {str(vlan): {"name": f"VLAN{vlan:04}", "state": "active"} for vlan in range(1, 200)}}
+    with mock.patch('network_device_api.main.async_send_command', mock.AsyncMock(return_value=vlans)):
+        response = client.get("/1.1.1.1/vlans/", headers={"Accept-Encoding": "gzip"})
+        assert response.headers["content-encoding"] == "gzip"
+        assert response.headers["vary"] == "Accept-Encoding"
+        assert response.headers["etag"]
+        assert response.json()["detail"] == vlans
+
+        response = client.get("/1.1.1.1/vlans/", headers={"Accept-Encoding": "identity"})
+        assert "content-encoding" not in response.headers
+        assert response.json()["detail"] == vlans
+
+        # Too small to be worth compressing
+        response = client.get("/", headers={"Accept-Encoding": "gzip"})
+        assert "content-encoding" not in response.headers
+
+INTERFACES = {
+    "GigabitEthernet1": {"oper_status": "up", "description": "uplink", "enabled": True, "counters": {"in_pkts": 10}},
+    "GigabitEthernet2": {"oper_status": "down", "description": "spare", "enabled": False, "counters": {"in_pkts": 0}},
+    "Loopback0": {"oper_status": "up", "enabled": True},
+}
+
+def test_projection():
+    assert Projection("*.oper_status,*.description").apply(INTERFACES) == {
+        "GigabitEthernet1": {"oper_status": "up", "description": "uplink"},
+        "GigabitEthernet2": {"oper_status": "down", "description": "spare"},
+        "Loopback0": {"oper_status": "up"},
+    }
+    assert Projection(exclude="*.counters,Loop*").apply(INTERFACES) == {
+        "GigabitEthernet1": {"oper_status": "up", "description": "uplink", "enabled": True},
+        "GigabitEthernet2": {"oper_status": "down", "description": "spare", "enabled": False},
+    }
+    assert Projection("*.description", where="oper_status==down").apply(INTERFACES) == {
+        "GigabitEthernet2": {"description": "spare"}
+    }
+    assert list(Projection(where="enabled==true,counters.in_pkts!=10").apply(INTERFACES)) == ["Loopback0"]
+
+    vlans = {"vlans": {"1": {"state": "active"}, "2": {"state": "suspend"}}}
+    assert Projection(where="vlans.*.state==active").apply(vlans) == {"vlans": {"1": {"state": "active"}}}
+    assert Projection("*.nothing").apply(INTERFACES) == {}
+    assert not Projection()
+
+    with pytest.raises(ValueError):
+        Projection(where="oper_status")
+
+def test_show_interfaces_projection():
+    with mock.patch('network_device_api.main.async_send_command', mock.AsyncMock(return_value=INTERFACES)):
+        response = client.get("/1.1.1.1/interfaces/?fields=*.oper_status&where=oper_status==down")
+        assert response.json()["detail"] == {"GigabitEthernet2": {"oper_status": "down"}}
+        projected_etag = response.headers["etag"]
+
+        response = client.get("/1.1.1.1/interfaces/")
+        assert response.headers["etag"] != projected_etag
+        assert response.json()["detail"] == INTERFACES
+
+        response = client.get("/1.1.1.1/interfaces/?fields=*.oper_status&where=oper_status==down",
+                              headers={"If-None-Match": projected_etag})
+        assert response.status_code == 304
+
+    response = client.get("/1.1.1.1/interfaces/?where=oper_status")
+    assert response.status_code == 400
+
+def test_paginate():
+    vlans = {"vlans": {str(vlan): {"name": f"VLAN{vlan}"} for vlan in range(1, 6)}}
+    assert paginate(vlans, 0, 2) == ({"vlans": {"1": {"name": "VLAN1"}, "2": {"name": "VLAN2"}}}, 2, 5)
+    assert paginate(vlans, 4, 2) == ({"vlans": {"5": {"name": "VLAN5"}}}, None, 5)
+    # Interface names are the collection, a lone interface isn't descended into
+    interfaces = {"Gi1": {"oper_status": "up", "counters": {}}}
+    assert paginate(interfaces, 0, 10) == (interfaces, None, 1)
+
+    page = Page(cursor="abc:20")
+    assert (page.version, page.offset) == ("abc", 20)
+    with pytest.raises(ValueError):
+        Page(cursor="20")
+
+def test_show_vlans_pages():
+    outputs = [{"vlans": {str(vlan): {"name": f"VLAN{vlan}"} for vlan in range(1, 4)}}, {"vlans": {}}]
+    send_command = mock.AsyncMock(side_effect=outputs)
+
+    with mock.patch('network_device_api.main.async_send_command', send_command):
+        first = client.get("/1.1.1.1/vlans/?limit=2").json()
+        assert list(first["detail"]["vlans"]) == ["1", "2"]
+        assert first["total"] == 3
+        assert first["next"] == f"{first['version']}:2"
+
+        # The output changes in between, the next page still comes from the same snapshot
+        client.get("/1.1.1.1/vlans/", headers={"Cache-Control": "no-cache"})
+        second = client.get(f"/1.1.1.1/vlans/?limit=2&cursor={first['next']}").json()
+        assert second["detail"] == {"vlans": {"3": {"name": "VLAN3"}}}
+        assert second["next"] is None
+        assert send_command.await_count == 2
+
+    assert client.get("/1.1.1.1/vlans/?cursor=unknown:2").status_code == 410
+    assert client.get("/1.1.1.1/vlans/?limit=2&since=abc").status_code == 400
+
+def test_compiled_templates():
+    ttp = mock.MagicMock()
+    ttp.return_value.result.return_value = {"network_device_api": [[{"hostname": "csr1000v"}]]}
+    ttp_templates.clear_compiled()
+
+    with mock.patch('network_device_api.templates._ttp', mock.MagicMock(return_value=ttp)):
+        for number in range(3):
+            result = parsing.parse_output(f"hostname csr{number}", "show run", template="hostname {{ hostname }}")
+            assert result == [[{"hostname": "csr1000v"}]]
+        # Compiled once, then only parsed
+        assert ttp.call_count == 1
+        ttp.return_value.add_template.assert_called_once()
+        assert ttp.return_value.parse.call_count == 3
+
+        assert connect_device._test_command("hostname csr4", template="hostname {{ hostname }}") == [{"hostname": "csr1000v"}]
+        assert ttp.call_count == 1
+
+        ttp.return_value.parse.side_effect = Exception("bad template")
+        assert ttp_templates.ttp_parse("{{ broken", "output") == []
+
+@mock.patch('network_device_api.main.TTP_TEMPLATE_UPLOADS', True)
+def test_templates_by_name():
+    send_command = mock.AsyncMock(return_value=[[{"hostname": "csr1000v"}]])
+    payload = {"hosts": ["1.1.1.1"], "command": "show run", "template": "hostname"}
+
+    try:
+        assert client.post("/bulk/command/", json=payload).status_code == 422
+
+        response = client.put("/templates/hostname", content="hostname {{ hostname }}")
+        assert response.status_code == 201
+        digest = response.json()["detail"]["digest"]
+        assert client.get("/templates/").json()["detail"] == {"hostname": digest}
+
+        with mock.patch('network_device_api.main.async_send_command', send_command):
+            response = client.post("/bulk/command/", json=payload)
+            assert response.json()["detail"] == {"1.1.1.1": [[{"hostname": "csr1000v"}]]}
+            assert send_command.await_args.kwargs["template"] == "hostname {{ hostname }}"
+
+            # A changed template isn't answered with output parsed by the old one
+            client.put("/templates/hostname", content="hostname {{ name }}")
+            client.post("/bulk/command/", json=payload)
+            assert send_command.await_count == 2
+
+        assert client.delete("/templates/hostname").status_code == 200
+        assert client.delete("/templates/hostname").status_code == 404
+    finally:
+        templates.remove("hostname")
+
+def test_template_uploads():
+    assert client.put("/templates/hostname", content="hostname {{ hostname }}").status_code == 403
+
+    ttp = mock.MagicMock()
+    ttp.return_value.add_template.side_effect = Exception("mismatched tag: line 3, column 2")
+    ttp_templates.clear_compiled()
+    with mock.patch('network_device_api.main.TTP_TEMPLATE_UPLOADS', True), \
+         mock.patch('network_device_api.templates._ttp', mock.MagicMock(return_value=ttp)):
+        # Anything TTP would run as Python or use to read and write files is refused
+        for text in ("<macro>\nimport os\n</macro>", "<vars load='python'>x = 1</vars>",
+                     "<group input='/etc/passwd'>{{ line }}</group>", "<output returner='file' url='/tmp/'/>"):
+            response = client.put("/templates/evil", content=text)
+            assert response.status_code == 400
+            assert "isn't allowed" in response.json()["detail"]
+
+        # Broken templates are refused when uploaded, not on every parse after
+        response = client.put("/templates/broken", content="<group name='x'>\n{{ name }}\n</grou>")
+        assert response.status_code == 400
+        assert response.json()["detail"].startswith("invalid template")
+
+        assert client.put("/templates/binary", content=b"\xff\xfe").status_code == 400
+        assert "evil" not in templates and "broken" not in templates
+
+def test_bulk_command():
+    async def send_command(host, command, **kwargs):
+        if host == "2.2.2.2":
+            raise scrapli.exceptions.ScrapliAuthenticationFailed
+        return {"vlans": {"host": host}}
+
+    with mock.patch('network_device_api.main.async_send_command', mock.AsyncMock(side_effect=send_command)) as send:
+        payload = {"hosts": ["1.1.1.1", "2.2.2.2", "3.3.3.3", "1.1.1.1"], "command": "show vlan", "concurrency": 2}
+        response = client.post("/bulk/command/", json=payload)
+        assert response.status_code == 200
+        assert response.json()["detail"] == {
+            "1.1.1.1": {"vlans": {"host": "1.1.1.1"}},
+            "3.3.3.3": {"vlans": {"host": "3.3.3.3"}},
+        }
+        assert response.json()["errors"] == {"2.2.2.2": "Timed out connecting to host, does it exist?"}
+        assert send.await_count == 3
+
+    response = client.post("/bulk/command/", json={"hosts": ["1.1.1.1"], "command": "reload"})
+    assert response.status_code == 422
+
+def test_bulk_command_stream():
+    async def send_command(host, command, **kwargs):
+        if host == "2.2.2.2":
+            raise scrapli.exceptions.ScrapliAuthenticationFailed
+        return {"vlans": {"host": host}}
+
+    with mock.patch('network_device_api.main.async_send_command', mock.AsyncMock(side_effect=send_command)):
+        payload = {"hosts": ["1.1.1.1", "2.2.2.2"], "command": "show vlan"}
+        response = client.post("/bulk/command/stream/", json=payload)
+        assert response.status_code == 200
+        assert response.headers["content-type"] == "application/x-ndjson"
+        lines = [json.loads(line) for line in response.text.splitlines()]
+        assert sorted(lines, key=lambda line: line["host"]) == [
+            {"host": "1.1.1.1", "detail": {"vlans": {"host": "1.1.1.1"}}},
+            {"host": "2.2.2.2", "error": "Timed out connecting to host, does it exist?"},
+        ]
+
+def test_jobs():
+    async def send_command(host, command, **kwargs):
+        return {"vlans": {"host": host}}
+
+    with TestClient(app) as job_client, \
+         mock.patch('network_device_api.main.async_send_command', mock.AsyncMock(side_effect=send_command)):
+        response = job_client.post("/jobs/bulk/command/", json={"hosts": ["1.1.1.1"], "command": "show vlan"})
+        assert response.status_code == 202
+        job_id = response.json()["detail"]["id"]
+
+        response = job_client.get(f"/jobs/{job_id}?wait=5")
+        assert response.json()["detail"]["status"] == "succeeded"
+        assert response.json()["detail"]["result"]["detail"] == {"1.1.1.1": {"vlans": {"host": "1.1.1.1"}}}
+
+        response = job_client.get("/jobs/nope")
+        assert response.status_code == 404
+
+def test_job_cancel_and_timeout():
+    async def slow_copy(*args, **kwargs):
+        await asyncio.sleep(10)
+
+    events = [["copy flash: scp:", "Source filename []?", False], ["somefile.txt", "Address or name of remote host []?", False]]
+    with TestClient(app) as job_client, \
+         mock.patch('network_device_api.main.async_send_command', mock.AsyncMock(side_effect=slow_copy)) as send:
+        response = job_client.post("/1.1.1.1/jobs/interactive/?timeout=0.1", json={"events": events})
+        job_id = response.json()["detail"]["id"]
+        statuses = [json.loads(line)["status"] for line in job_client.get(f"/jobs/{job_id}/stream/").text.splitlines()]
+        assert statuses[-1] == "timed_out"
+        assert send.call_args.kwargs["interactive"] is True
+
+        response = job_client.post("/1.1.1.1/jobs/interactive/", json={"events": events})
+        job_id = response.json()["detail"]["id"]
+        job_client.get(f"/jobs/{job_id}?wait=0.05")
+        response = job_client.delete(f"/jobs/{job_id}")
+        response = job_client.get(f"/jobs/{job_id}?wait=5")
+        assert response.json()["detail"]["status"] == "cancelled"
+
+        response = job_client.post("/1.1.1.1/jobs/interactive/", json={"events": [["reload", "confirm", False]]})
+        assert response.status_code == 422
+
+        # Nor can a copy, or any answer after it, smuggle other commands in on new lines
+        for smuggled in ([["copy flash: scp:\nreload", "confirm", False]],
+                         [events[0], ["somefile.txt\nconfigure terminal\nno ip routing", "[]?", False]]):
+            response = job_client.post("/1.1.1.1/jobs/interactive/", json={"events": smuggled})
+            assert response.status_code == 422
+        assert send.await_count == 2
+
+def test_job_retention():
+    manager = JobManager(workers=1, retention=0)
+
+    async def run():
+        job = manager.submit("quick", mock.AsyncMock(return_value=1))
+        await manager.wait(job, 1)
+        await manager.close()
+        return job
+
+    job = asyncio.run(run())
+    assert job.result == 1
+    time.sleep(0.01)
+    assert manager.get(job.id) is None
+
+def test_poller():
+    send_commands = mock.AsyncMock(side_effect=lambda device, commands, **kwargs: [{"device": device, "command": command} for command in commands])
+    test_poller = Poller(refresh_device, devices=["1.1.1.1", "2.2.2.2"], commands=["show vlan", "show ip interface brief"], interval=60)
+
+    with mock.patch('network_device_api.main.async_send_commands', send_commands), \
+         mock.patch('network_device_api.main.poller', test_poller), \
+         mock.patch('network_device_api.main.async_send_command', mock.AsyncMock()) as send_command:
+        assert asyncio.run(test_poller.poll_once()) == 0
+        # One session per device per round
+        assert send_commands.await_count == 2
+
+        response = client.get("/2.2.2.2/ip-interfaces/")
+        assert response.json()["detail"] == {"device": "2.2.2.2", "command": "show ip interface brief"}
+        assert response.headers["cache-control"] == "max-age=120"
+        send_command.assert_not_awaited()
+
+    send_commands = mock.AsyncMock(side_effect=scrapli.exceptions.ScrapliAuthenticationFailed("unreachable"))
+    with mock.patch('network_device_api.main.async_send_commands', send_commands), \
+         mock.patch('network_device_api.main.poller', test_poller):
+        assert asyncio.run(test_poller.poll_once()) == 2
+        assert test_poller.status()["rounds"] == 2
+        assert "unreachable" in test_poller.status()["errors"]["1.1.1.1"]
+
+PARSE_RECORDS = [
+    {"id": "sw1", "command": "show vlan", "output": "VLAN Name\n1 default"},
+    {"id": "sw2", "command": "show clock", "output": "12:00:00"},
+]
+
+def parse_body(records):
+    return b"".join(json.dumps(record).encode() + b"\n" for record in records) + b"not json\n"
+
+def test_offline_parse():
+    with fake_genie({"show vlan": fake_parser({"vlans": {"1": {}}})}):
+        response = client.post("/parse/", content=parse_body(PARSE_RECORDS), headers={"Content-Type": "application/x-ndjson"})
+        assert response.headers["content-type"] == "application/x-ndjson"
+        results = sorted((json.loads(line) for line in response.text.splitlines()), key=lambda line: line["index"])
+        assert results == [
+            {"index": 0, "id": "sw1", "detail": {"vlans": {"1": {}}}},
+            {"index": 1, "id": "sw2", "error": "ValueError: no parser for show clock on iosxe"},
+            {"index": 2, "error": mock.ANY},
+        ]
+        assert results[2]["error"].startswith("JSONDecodeError")
+
+        # Made up platforms are refused before they reach Genie or any per platform cache
+        records = [{"id": f"sw{n}", "command": "show vlan", "output": "VLAN Name", "platform": f"os{n}"} for n in range(20)]
+        response = client.post("/parse/", content=parse_body(records))
+        errors = [json.loads(line)["error"] for line in response.text.splitlines()]
+        assert sum(error.startswith("ValueError: unknown platform os") for error in errors) == 20
+        assert parsing.parser_registry.cache_info().currsize <= 1
+        assert parsing._genie_device.cache_info().maxsize == 16
+
+        archive = io.BytesIO()
+        with tarfile.open(fileobj=archive, mode="w:gz") as tar:
+            body = parse_body(PARSE_RECORDS[:1])
+            member = tarfile.TarInfo("collected/sw1.jsonl")
+            member.size = len(body)
+            tar.addfile(member, io.BytesIO(body))
+        response = client.post("/parse/", content=archive.getvalue(), headers={"Content-Type": "application/gzip"})
+        assert [json.loads(line).get("id") for line in response.text.splitlines()].count("sw1") == 1
+
+        response = client.post("/parse/", content=b"not a tar", headers={"Content-Type": "application/x-tar"})
+        assert "invalid archive" in json.loads(response.text)["error"]
+
+    with mock.patch('network_device_api.main.OFFLINE_PARSE_MAX_BODY', 16):
+        response = client.post("/parse/", content=parse_body(PARSE_RECORDS))
+        assert response.status_code == 413
+        assert response.json() == {"detail": "Body is larger than 16 bytes"}
+
+def test_offline_parse_cli(tmp_path, capsysbinary):
+    source = tmp_path / "collected.jsonl"
+    source.write_bytes(parse_body(PARSE_RECORDS[:1]))
+
+    with fake_genie({"show vlan": fake_parser({"vlans": {"1": {}}})}):
+        assert offline_parse.main([str(source), "--workers", "0"]) == 1
+
+    lines = [json.loads(line) for line in capsysbinary.readouterr().out.splitlines()]
+    assert sorted(lines, key=lambda line: line["index"])[0] == {"index": 0, "id": "sw1", "detail": {"vlans": {"1": {}}}}
+
+def test_fan_out_concurrency():
+    running, peak = 0, 0
+
+    async def call(item):
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        await asyncio.sleep(0.01)
+        running -= 1
+        return item * 2
+
+    async def collect():
+        return [outcome async for outcome in fan_out(range(20), call, concurrency=4)]
+
+    outcomes = asyncio.run(collect())
+    assert sorted(result for _, result, _ in outcomes) == [item * 2 for item in range(20)]
+    assert peak == 4
+
+INVENTORY_YAML = """
+defaults:
+  username: admin
+  password: $SWITCH_PASSWORD
+devices:
+  core1:
+    host: 10.0.0.1
+    platform: cisco_nxos
+    max_sessions: 4
+    tags: [core, dc1]
+  edge1:
+    host: 10.0.0.2
+    tags: edge, dc1
+    timeout_ops: 60
+"""
+
+def test_inventory(tmp_path, monkeypatch):
+    monkeypatch.setenv("SWITCH_PASSWORD", "secret")
+    path = tmp_path / "inventory.yml"
+    path.write_text(INVENTORY_YAML)
+    devices = Inventory.load(str(path))
+
+    assert len(devices) == 2
+    assert devices.get("core1") is devices.get("10.0.0.1")
+    assert devices.get("core1").driver is scrapli.driver.core.NXOSDriver
+    assert devices.get("edge1").platform == "cisco_iosxe"
+    assert devices.tagged(["dc1"]) == ["core1", "edge1"]
+    assert devices.tagged(["dc1", "core"]) == ["core1"]
+    assert devices.tagged(["dc2"]) == []
+    # Parsers are prewarmed for every platform in use, and IOS-XE for devices outside the inventory
+    assert devices.genie_platforms() == ("iosxe", "nxos")
+
+    settings = devices.get("edge1").settings("asyncssh")
+    assert (settings["host"], settings["auth_username"], settings["auth_password"], settings["timeout_ops"]) == ("10.0.0.2", "admin", "secret", 60)
+    assert devices.get("edge1").settings("asyncssh", username="ops")["auth_username"] == "ops"
+    assert "password" not in devices.get("core1").as_dict()
+
+    # Anything not in the inventory is treated as an IOS-XE device with the default credentials
+    assert devices.get("10.9.9.9") == Device("10.9.9.9")
+
+    for entry in ("platform: cisco_ios", "hostname: sw1"):
+        path.write_text(f"devices:\n  sw1:\n    {entry}\n")
+        with pytest.raises(ValueError):
+            Inventory.from_yaml(path)
+
+def test_inventory_sqlite(tmp_path):
+    path = str(tmp_path / "inventory.db")
+    with sqlite3.connect(path) as db:
+        db.execute("CREATE TABLE devices (name TEXT, host TEXT, platform TEXT, tags TEXT)")
+        db.execute("INSERT INTO devices VALUES ('sw1', '10.0.0.1', 'arista_eos', 'access,dc1'), ('sw2', '10.0.0.2', NULL, NULL)")
+
+    devices = Inventory.load(path)
+    assert devices.get("10.0.0.1").platform == "arista_eos"
+    assert devices.get("sw2").platform == "cisco_iosxe"
+    assert devices.tagged(["access"]) == ["sw1"]
+
+def test_inventory_sessions():
+    response, genie_parse = device_response("raw output")
+    driver = fake_driver(response)
+    pool = ConnectionPool(max_sessions=2)
+    devices = Inventory([Device("10.0.0.1", name="core1", username="admin", password="secret", max_sessions=5)])
+
+    with fake_platform(async_driver=driver), genie_parse, \
+         mock.patch('network_device_api.connect_device.inventory', devices), \
+         mock.patch('network_device_api.connect_device.pool', pool):
+        assert asyncio.run(connect_device.async_send_command("core1", "show clock")) == "raw output"
+
+    # The name resolves to the device's address, credentials and session limit
+    assert driver.call_args.kwargs["host"] == "10.0.0.1"
+    assert driver.call_args.kwargs["auth_password"] == "secret"
+    assert pool._limits["10.0.0.1"].max_sessions == 5
+
+def test_inventory_cache_keys():
+    devices = Inventory([Device("10.0.0.1", name="core1", tags=frozenset({"core"}))])
+    send_command = mock.AsyncMock(side_effect=AssertionError("should be served from the cache"))
+
+    with mock.patch('network_device_api.main.inventory', devices), \
+         mock.patch('network_device_api.connect_device.inventory', devices), \
+         mock.patch('network_device_api.main.async_send_command', send_command):
+        # Warmed by name (the poller and tag based bulk requests), read by address
+        refresh = mock.AsyncMock(return_value=[{"vlans": {"1": {}}}])
+        with mock.patch('network_device_api.main.async_send_commands', refresh):
+            asyncio.run(refresh_device("core1", ["show vlan"]))
+        response = client.get("/10.0.0.1/vlans/")
+        assert response.json()["detail"] == {"vlans": {"1": {}}}
+
+        # A push by address drops what was cached by name
+        assert invalidate_device("10.0.0.1") == 1
+        assert cache_key("core1", "show vlan") == cache_key("10.0.0.1", "show vlan")
+
+def test_bulk_command_tags():
+    async def send_command(host, command, **kwargs):
+        return {"vlans": {"host": host}}
+
+    devices = Inventory([Device("10.0.0.1", name="core1", tags=frozenset({"core"})),
+                         Device("10.0.0.2", name="edge1", tags=frozenset({"edge"}))])
+    with mock.patch('network_device_api.main.inventory', devices), \
+         mock.patch('network_device_api.main.async_send_command', mock.AsyncMock(side_effect=send_command)):
+        response = client.post("/bulk/command/", json={"hosts": ["1.1.1.1"], "tags": ["core"], "command": "show vlan"})
+        assert response.status_code == 200
+        assert set(response.json()["detail"]) == {"1.1.1.1", "core1"}
+
+        assert client.post("/bulk/command/", json={"tags": ["dc9"], "command": "show vlan"}).status_code == 422
+        assert client.post("/bulk/command/", json={"command": "show vlan"}).status_code == 422
+
+        response = client.get("/inventory/", params={"tag": "edge"})
+        assert [device["name"] for device in response.json()["detail"]] == ["edge1"]